@@ -0,0 +1,235 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from export import build_department_zip, build_excel_bytes
+from history_store import save_history
+from holiday_calendar import build_calendar_index
+from ingest import INPUT_FORMATS, input_format, open_partitions
+from instrument import peak_rss_mb
+from result_store import process_incremental
+from subsidy_rules import load_rules
+from subsidy import (
+    compute_stream, data_years, parse_date_set,
+    prepare_partitions,
+)
+
+
+OUTPUT_SUFFIX = "_餐补计算结果.xlsx"
+DEPARTMENT_ZIP_SUFFIX = "_餐补计算结果_按部门.zip"
+
+
+# 展开输入参数：目录取其中所有 CSV 文件
+def collect_inputs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                p for p in glob.glob(os.path.join(path, "*"))
+                if os.path.splitext(p)[1].lower().lstrip(".") in INPUT_FORMATS
+            ))
+        else:
+            files.append(path)
+    return files
+
+
+# 输出文件路径：输出目录下以输入文件名命名
+def output_path_for(input_path, output_dir):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, stem + OUTPUT_SUFFIX)
+
+
+# 处理单个文件，返回该文件的处理摘要（含各阶段耗时）
+# store_dir 不为空时按天保存结果，只计算新增或有变动的日期；history_db 不为空时同时写入历史记录库
+# split_departments 为 True 时另在 Excel 旁生成按部门拆分的 ZIP
+def process_file(input_path, output_path, holiday_year, overtime_dates, high_temp_days, engine,
+                 store_dir=None, rules=None, compute_workers=1, summary_sheets=False,
+                 history_db=None, split_departments=False):
+    summary = {"input": input_path, "output": output_path, "status": "ok", "timings": {}}
+    timings = summary["timings"]
+    started = time.perf_counter()
+
+    try:
+        t = time.perf_counter()
+        with open(input_path, "rb") as f, open_partitions(f, input_format(input_path)) as opened:
+            used_encoding, parts, years = opened
+            timings["read"] = time.perf_counter() - t
+
+            # 日历覆盖数据中出现的年份；指定了节假日年份时另外加入该年
+            t = time.perf_counter()
+            extra_years = {holiday_year} if holiday_year else set()
+            if store_dir:
+                # 按天比对需要全部分区
+                partitions, invalid_time_count = prepare_partitions(parts)
+                calendar_index = build_calendar_index(
+                    data_years(partitions) | extra_years, overtime_dates, high_temp_days
+                )
+                df_final, store_stats = process_incremental(
+                    partitions, calendar_index, store_dir, engine, rules, compute_workers
+                )
+                summary.update(store_stats)
+            else:
+                # 逐个分区计算，只保留计算结果
+                df_final, invalid_time_count = compute_stream(
+                    parts, years, overtime_dates, high_temp_days, engine, rules, compute_workers,
+                    extra_years,
+                )
+            timings["compute"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        with open(output_path, "wb") as f:
+            f.write(build_excel_bytes(df_final, summary=summary_sheets).getbuffer())
+        if split_departments:
+            zip_path = output_path[:-len(OUTPUT_SUFFIX)] + DEPARTMENT_ZIP_SUFFIX
+            with open(zip_path, "wb") as f:
+                build_department_zip(df_final, compute_workers, summary=summary_sheets, output=f)
+            summary["department_zip"] = zip_path
+        timings["write"] = time.perf_counter() - t
+
+        if history_db:
+            t = time.perf_counter()
+            save_history(df_final, history_db)
+            timings["history"] = time.perf_counter() - t
+
+        summary.update(
+            encoding=used_encoding,
+            rows=len(df_final),
+            invalid_time_count=invalid_time_count,
+        )
+        if holiday_year:
+            summary["holiday_year"] = holiday_year
+    except Exception as e:
+        summary.update(status="error", error=f"{type(e).__name__}: {e}")
+
+    timings["total"] = time.perf_counter() - started
+    # 多个文件在同一工作进程中处理时，为该进程到目前为止的峰值
+    summary["peak_rss_mb"] = peak_rss_mb()
+    return summary
+
+
+# 单个文件结果的一行文字说明
+def format_result(result):
+    timings = result["timings"]
+    if result["status"] != "ok":
+        return f"[失败] {result['input']}：{result['error']}（{timings['total']:.2f} 秒）"
+    return (
+        f"[完成] {result['input']} -> {result['output']}：{result['rows']} 行，"
+        f"读取 {timings['read']:.2f} 秒，计算 {timings['compute']:.2f} 秒，"
+        f"写入 {timings['write']:.2f} 秒"
+        + (f"，峰值内存 {result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] else "")
+    )
+
+
+# 命令行参数
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="批量计算餐补：每个输入 CSV 生成一个 Excel 文件，并输出运行摘要。"
+    )
+    parser.add_argument("inputs", nargs="+", help="CSV 文件或包含 CSV 文件的目录")
+    parser.add_argument("-o", "--output-dir", default="output", help="输出目录（默认 output）")
+    parser.add_argument("--holiday-year", type=int, default=None,
+                        help="另外加入日历的年份；数据中出现的年份总会使用各自的节假日，一般无需指定")
+    parser.add_argument("--overtime", default="",
+                        help="加班调休日期，格式：YYYY-MM-DD,YYYY-MM-DD,...")
+    parser.add_argument("--high-temp", default="",
+                        help="高温假日期，格式：YYYY-MM-DD,YYYY-MM-DD,...")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="并行进程数（默认 CPU 核数）")
+    parser.add_argument("--compute-workers", type=int, default=1,
+                        help="单个文件按个人编号分片计算的进程数（默认 1，需要 pyarrow；"
+                             "只对 --engine legacy 生效），同时用于按部门拆分")
+    parser.add_argument("--engine", choices=["vectorized", "legacy"], default="vectorized",
+                        help="计算引擎（默认 vectorized）")
+    parser.add_argument("--store-dir", default=None,
+                        help="按天保存计算结果的目录；指定后只计算新增或有变动的日期（需要 pyarrow）")
+    parser.add_argument("--rules", default=None,
+                        help="补贴规则表 CSV 路径（默认 subsidy_rules.csv）")
+    parser.add_argument("--summary-sheets", action="store_true",
+                        help="在 Excel 中附加按人员、部门、日期的汇总表")
+    parser.add_argument("--split-departments", action="store_true",
+                        help="另生成按卡户部门拆分的 ZIP（每个部门一个工作簿，进程数同 --compute-workers）")
+    parser.add_argument("--history-db", default=None,
+                        help="同时把结果写入该历史记录库（SQLite），供 history_store.py 跨月份查询")
+    parser.add_argument("--summary", default=None,
+                        help="运行摘要 JSON 路径（默认 输出目录/run_summary.json）")
+    return parser
+
+
+# 批量处理入口：多进程并行处理所有输入文件，返回进程退出码
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    overtime_dates, overtime_invalid = parse_date_set(args.overtime)
+    high_temp_days, high_temp_invalid = parse_date_set(args.high_temp)
+    if overtime_invalid:
+        parser.error(f"加班调休日期格式无效：{', '.join(overtime_invalid)}")
+    if high_temp_invalid:
+        parser.error(f"高温假日期格式无效：{', '.join(high_temp_invalid)}")
+
+    try:
+        rules = load_rules(args.rules)
+    except (OSError, ValueError) as e:
+        parser.error(f"补贴规则表读取失败：{e}")
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("没有找到输入文件。")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = [output_path_for(path, args.output_dir) for path in inputs]
+    duplicated = sorted({p for p in outputs if outputs.count(p) > 1})
+    if duplicated:
+        parser.error(f"多个输入文件同名，输出会互相覆盖：{', '.join(duplicated)}")
+
+    jobs = [
+        (path, out, args.holiday_year, overtime_dates, high_temp_days, args.engine, args.store_dir,
+         rules, args.compute_workers, args.summary_sheets, args.history_db, args.split_departments)
+        for path, out in zip(inputs, outputs)
+    ]
+
+    started = time.perf_counter()
+    results = []
+    workers = max(1, min(args.workers, len(jobs)))
+    if workers == 1:
+        for job in jobs:
+            results.append(process_file(*job))
+            print(format_result(results[-1]), flush=True)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_file, *job) for job in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print(format_result(results[-1]), flush=True)
+
+    # 摘要按输入顺序排列
+    order = {path: i for i, path in enumerate(inputs)}
+    results.sort(key=lambda r: order[r["input"]])
+
+    failed = [r for r in results if r["status"] != "ok"]
+    run_summary = {
+        "workers": workers,
+        "files": len(results),
+        "failed": len(failed),
+        "rows": sum(r.get("rows", 0) for r in results),
+        "elapsed": time.perf_counter() - started,
+        "results": results,
+    }
+
+    summary_path = args.summary or os.path.join(args.output_dir, "run_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(run_summary, f, ensure_ascii=False, indent=2, default=str)
+
+    print(
+        f"完成 {len(results) - len(failed)}/{len(results)} 个文件，"
+        f"共 {run_summary['rows']} 行，用时 {run_summary['elapsed']:.2f} 秒；摘要：{summary_path}"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
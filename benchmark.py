@@ -0,0 +1,286 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from export import build_excel_bytes
+from holiday_calendar import build_calendar_index
+from ingest import read_csv_with_fallback
+from subsidy import (
+    clean_columns, compute_partitions, data_years, parse_trade_time,
+    prepare_dataframe,
+)
+
+
+SURNAMES = list("王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗")
+GIVEN_NAMES = list("伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂")
+DEPARTMENTS = [
+    "计算机学院", "数学学院", "物理学院", "化学学院", "生命科学学院", "经济管理学院",
+    "外国语学院", "机械工程学院", "电子信息学院", "土木工程学院", "图书馆", "后勤处",
+    "财务处", "教务处", "研究生院", "校医院",
+]
+CANTEENS = ["一食堂", "二食堂", "三食堂", "教工餐厅"]
+PERSON_TYPES = ["职工", "研究生", "外聘"]
+PERSON_TYPE_SHARE = [0.6, 0.35, 0.05]
+
+# 早餐、午餐、晚餐、其他时段的时间范围（秒）
+MEAL_WINDOWS = [
+    (7 * 3600 + 20 * 60, 9 * 3600),
+    (11 * 3600, 14 * 3600),
+    (17 * 3600, 20 * 3600),
+    (0, 24 * 3600 - 1),
+]
+MEAL_AMOUNTS = [(2.0, 8.0), (8.0, 30.0), (8.0, 30.0), (3.0, 20.0)]
+MALFORMED_TIMES = ["", "无", "2024-13-45 99:00:00", "--"]
+
+STAGES = ["decode", "clean", "time_parse", "meal_bucketing", "subsidy", "excel_write"]
+
+
+# 生成模拟的一卡通消费明细，列与卡务系统导出一致，另带几列处理时用不到的列
+def generate_transactions(rows, people=None, days=30, start="2024-09-01",
+                          meal_mix=(0.2, 0.4, 0.25, 0.15), market_share=0.1,
+                          reversal_share=0.02, bad_time_share=0.001, seed=0):
+    rng = np.random.default_rng(seed)
+    people = people or max(10, rows // 300)
+
+    # 人员信息
+    names = np.array([
+        rng.choice(SURNAMES) + "".join(rng.choice(GIVEN_NAMES, rng.integers(1, 3)))
+        for _ in range(people)
+    ], dtype=object)
+    person_ids = np.arange(20000001, 20000001 + people)
+    person_types = rng.choice(PERSON_TYPES, people, p=PERSON_TYPE_SHARE)
+    departments = rng.choice(DEPARTMENTS, people)
+    card_types = rng.choice(["正式卡", "临时卡"], people, p=[0.95, 0.05])
+    who = rng.integers(0, people, rows)
+
+    # 交易时间：按餐段比例取时间窗口内的随机时刻
+    meal = rng.choice(len(MEAL_WINDOWS), rows, p=np.asarray(meal_mix) / np.sum(meal_mix))
+    low = np.array([w[0] for w in MEAL_WINDOWS])[meal]
+    high = np.array([w[1] for w in MEAL_WINDOWS])[meal]
+    seconds = rng.integers(low, high + 1)
+    day = rng.integers(0, days, rows)
+    trade_time = (
+        np.datetime64(start, "s")
+        + day.astype("timedelta64[D]")
+        + seconds.astype("timedelta64[s]")
+    )
+    trade_time_text = np.char.replace(np.datetime_as_string(trade_time, unit="s"), "T", " ").astype(object)
+    bad = rng.random(rows) < bad_time_share
+    trade_time_text[bad] = rng.choice(MALFORMED_TIMES, int(bad.sum()))
+
+    # 交易地点与金额
+    is_market = rng.random(rows) < market_share
+    location = np.where(is_market, "超市", rng.choice(CANTEENS, rows)).astype(object)
+    amount_low = np.array([a[0] for a in MEAL_AMOUNTS])[meal]
+    amount_high = np.array([a[1] for a in MEAL_AMOUNTS])[meal]
+    amount = np.round(rng.uniform(amount_low, amount_high), 2)
+    amount[is_market] = np.round(rng.uniform(3.0, 60.0, int(is_market.sum())), 2)
+
+    # 收费冲正记录金额为负
+    is_reversal = rng.random(rows) < reversal_share
+    trade_type = np.where(is_reversal, "收费冲正", "消费").astype(object)
+    amount[is_reversal] = -amount[is_reversal]
+
+    # 少量前后带空格 / 制表符的值，覆盖清洗逻辑
+    padded = rng.random(rows) < 0.01
+    location[padded] = location[padded] + "\t"
+
+    return pd.DataFrame({
+        "流水号": np.arange(1, rows + 1),
+        "人员类别": person_types[who],
+        "姓名": names[who],
+        "个人编号": person_ids[who],
+        "卡片类型": card_types[who],
+        "卡户部门": departments[who],
+        "交易地点": location,
+        "终端编号": rng.integers(1000, 1100, rows),
+        "交易金额": amount,
+        "交易时间": trade_time_text,
+        "交易类型": trade_type,
+        "余额": np.round(rng.uniform(0, 500, rows), 2),
+    })
+
+
+# 模拟数据写为 CSV 字节
+def to_csv_bytes(df, encoding="gbk"):
+    return df.to_csv(index=False).encode(encoding)
+
+
+# 计时执行一个阶段，返回 (结果, 秒数)
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+# 对一种数据规模依次运行各阶段；在独立子进程中执行，峰值内存只反映本规模
+def run_size(rows, options):
+    df = generate_transactions(
+        rows,
+        people=options["people"],
+        days=options["days"],
+        meal_mix=options["meal_mix"],
+        market_share=options["market_share"],
+        reversal_share=options["reversal_share"],
+        bad_time_share=options["bad_time_share"],
+        seed=options["seed"],
+    )
+    csv_bytes = to_csv_bytes(df, options["encoding"])
+    del df
+
+    timings = {}
+    (raw_df, _), timings["decode"] = timed(read_csv_with_fallback, BytesIO(csv_bytes))
+    df, timings["clean"] = timed(clean_columns, raw_df)
+    (df, invalid_time_count), timings["time_parse"] = timed(parse_trade_time, df)
+    df, timings["meal_bucketing"] = timed(prepare_dataframe, df)
+
+    started = time.perf_counter()
+    years = data_years([df])
+    calendar_index = build_calendar_index(years, set(), set())
+    df_final = compute_partitions([df], calendar_index, options["engine"])
+    timings["subsidy"] = time.perf_counter() - started
+
+    if not options["skip_excel"]:
+        _, timings["excel_write"] = timed(build_excel_bytes, df_final)
+
+    result = {
+        "rows": rows,
+        "csv_bytes": len(csv_bytes),
+        "rows_out": len(df_final),
+        "invalid_time_count": invalid_time_count,
+        "timings": timings,
+        # 准备好的工作数据（含字符串内容）所占内存
+        "frame_mb": df.memory_usage(deep=True).sum() / 1024 / 1024,
+        # Linux 下 ru_maxrss 单位为 KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "golden": check_golden(df_final, rows, options),
+    }
+
+    if options["check_legacy"]:
+        legacy = compute_partitions([df], calendar_index, "legacy")
+        result["legacy_match"] = bool(frames_equal(legacy, df_final))
+
+    return result
+
+
+# 两个结果是否完全一致（含顺序、索引和类型）
+def frames_equal(left, right):
+    try:
+        pd.testing.assert_frame_equal(left, right, check_exact=True)
+        return True
+    except AssertionError:
+        return False
+
+
+# 与保存的基准结果比对；--update-golden 时覆盖保存
+def check_golden(df_final, rows, options):
+    golden_dir = options["golden_dir"]
+    if not golden_dir:
+        return "skipped"
+
+    path = os.path.join(golden_dir, f"golden_{rows}_{options['seed']}_{options['encoding']}.pkl")
+    if options["update_golden"] or not os.path.exists(path):
+        os.makedirs(golden_dir, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(df_final, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return "written"
+
+    with open(path, "rb") as f:
+        golden = pickle.load(f)
+    return "match" if frames_equal(golden, df_final) else "MISMATCH"
+
+
+# 以表格形式输出各阶段耗时与吞吐量
+def format_report(result):
+    lines = [
+        f"== {result['rows']:,} 行（CSV {result['csv_bytes'] / 1024 / 1024:.1f} MB，"
+        f"输出 {result['rows_out']:,} 行，工作数据 {result['frame_mb']:.0f} MB，"
+        f"峰值内存 {result['peak_rss_mb']:.0f} MB，"
+        f"基准比对：{result['golden']}"
+        + (f"，与逐行计算一致：{result['legacy_match']}" if "legacy_match" in result else "")
+        + "）"
+    ]
+    for stage in STAGES:
+        if stage not in result["timings"]:
+            continue
+        seconds = result["timings"][stage]
+        throughput = result["rows"] / seconds if seconds > 0 else float("inf")
+        lines.append(f"  {stage:<16}{seconds:>10.3f} s{throughput:>16,.0f} 行/秒")
+    total = sum(result["timings"].values())
+    lines.append(f"  {'total':<16}{total:>10.3f} s{result['rows'] / total:>16,.0f} 行/秒")
+    return "\n".join(lines)
+
+
+# 命令行参数
+def build_parser():
+    parser = argparse.ArgumentParser(description="餐补计算流程基准测试")
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="数据行数，逗号分隔（默认 10000,100000,1000000）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--people", type=int, default=None, help="人数（默认 行数/300）")
+    parser.add_argument("--days", type=int, default=30, help="天数")
+    parser.add_argument("--meal-mix", default="0.2,0.4,0.25,0.15",
+                        help="早餐,午餐,晚餐,其他 时段的比例")
+    parser.add_argument("--market-share", type=float, default=0.1, help="超市消费占比")
+    parser.add_argument("--reversal-share", type=float, default=0.02, help="收费冲正占比")
+    parser.add_argument("--bad-time-share", type=float, default=0.001, help="无法解析的交易时间占比")
+    parser.add_argument("--encoding", choices=["gbk", "utf-8"], default="gbk", help="CSV 编码")
+    parser.add_argument("--engine", choices=["vectorized", "legacy"], default="vectorized")
+    parser.add_argument("--skip-excel", action="store_true", help="不测试 Excel 写入")
+    parser.add_argument("--check-legacy", action="store_true",
+                        help="同时用逐行计算并比对结果（只适合小数据量）")
+    parser.add_argument("--golden-dir", default=None, help="基准结果目录，不存在的基准会自动生成")
+    parser.add_argument("--update-golden", action="store_true", help="覆盖保存基准结果")
+    parser.add_argument("--json", default=None, help="将结果写入 JSON 文件")
+    return parser
+
+
+# 基准测试入口：每种规模在新的子进程中运行
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    options = {
+        "people": args.people,
+        "days": args.days,
+        "meal_mix": [float(x) for x in args.meal_mix.split(",")],
+        "market_share": args.market_share,
+        "reversal_share": args.reversal_share,
+        "bad_time_share": args.bad_time_share,
+        "encoding": args.encoding,
+        "engine": args.engine,
+        "seed": args.seed,
+        "skip_excel": args.skip_excel,
+        "check_legacy": args.check_legacy,
+        "golden_dir": args.golden_dir,
+        "update_golden": args.update_golden,
+    }
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for rows in (int(x) for x in args.sizes.split(",")):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_size, rows, options).result()
+        results.append(result)
+        print(format_report(result), flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = any(
+        r["golden"] == "MISMATCH" or r.get("legacy_match") is False for r in results
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+import multiprocessing
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from instrument import report_progress, stage
+from summaries import summary_tables
+
+
+SHEET_NAME = "餐补计算结果"
+
+# 各列宽度，未列出的列使用 DEFAULT_COLUMN_WIDTH
+COLUMN_WIDTHS = {
+    "人员类别": 10,
+    "姓名": 12,
+    "个人编号": 14,
+    "卡片类型": 12,
+    "交易地点": 16,
+    "卡户部门": 28,
+    "交易时间": 20,
+    "交易金额": 12,
+    "交易日期": 12,
+    "笔数": 10,
+    "早餐（元）": 12,
+    "工作餐（元）": 12,
+    "加班餐（元）": 12,
+    "自付（元）": 12,
+    "餐补合计（元）": 14,
+}
+DEFAULT_COLUMN_WIDTH = 13
+
+# 与 pandas 写 Excel 时的默认格式保持一致
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+DATE_FORMAT = "YYYY-MM-DD"
+
+# 存放日期（datetime.date）的列
+DATE_COLUMNS = {"交易日期"}
+
+EXCEL_ENGINES = ("auto", "xlsxwriter", "write_only", "openpyxl")
+
+# 逐行写入时每隔多少行报告一次进度
+PROGRESS_ROWS = 10_000
+
+# 按部门拆分时，卡户部门为空的记录归入的名称
+UNASSIGNED_DEPARTMENT = "未分配部门"
+
+
+# 逐行产出单元格值：空值写为空单元格，numpy 标量转为 Python 类型
+# 每次只把 block_rows 行转为 Python 对象，内存占用与块大小有关，与总行数无关
+def iter_rows(df, block_rows=PROGRESS_ROWS):
+    for start in range(0, len(df), block_rows):
+        block = df.iloc[start:start + block_rows]
+        columns = []
+        for col in block.columns:
+            series = block[col]
+            values = series.astype(object).where(series.notna(), None)
+            columns.append(values.tolist())
+        yield from zip(*columns)
+
+
+# 同 iter_rows，并报告所有工作表累计已写入的行数；written 为之前工作表已写入的行数
+def tracked_rows(df, written, total):
+    for i, row in enumerate(iter_rows(df), start=1):
+        if i % PROGRESS_ROWS == 0:
+            report_progress("excel_write", written + i, total)
+        yield row
+    report_progress("excel_write", written + len(df), total)
+
+
+# 各列的数字格式：时间列、日期列分别使用 DATETIME_FORMAT、DATE_FORMAT，其余列不设置
+def number_formats(df):
+    formats = []
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            formats.append(DATETIME_FORMAT)
+        elif col in DATE_COLUMNS:
+            formats.append(DATE_FORMAT)
+        else:
+            formats.append(None)
+    return formats
+
+
+# 原有写法：pandas + openpyxl，整个工作簿在内存中构建
+# sheets 为 [(工作表名, DataFrame), ...]，下同
+def _write_openpyxl(sheets, output):
+    from openpyxl.utils import get_column_letter
+
+    total = sum(len(df) for _, df in sheets)
+    written = 0
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for sheet_name, df in sheets:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+            ws = writer.book[sheet_name]
+
+            # 全表自动筛选
+            ws.auto_filter.ref = ws.dimensions
+
+            for i, header in enumerate(df.columns, start=1):
+                col_letter = get_column_letter(i)
+                ws.column_dimensions[col_letter].width = COLUMN_WIDTHS.get(header, DEFAULT_COLUMN_WIDTH)
+
+            written += len(df)
+            report_progress("excel_write", written, total)
+
+
+# xlsxwriter 常量内存模式：逐行写入并随时落盘，内存占用与行数无关
+def _write_xlsxwriter(sheets, output):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    formats = {
+        fmt: workbook.add_format({"num_format": fmt}) for fmt in (DATETIME_FORMAT, DATE_FORMAT)
+    }
+
+    total = sum(len(df) for _, df in sheets)
+    written = 0
+
+    # 常量内存模式下只能按顺序逐个写完每个工作表
+    for sheet_name, df in sheets:
+        ws = workbook.add_worksheet(sheet_name)
+
+        # 常量内存模式下列宽和列格式必须在写入数据前设置
+        for i, (header, fmt) in enumerate(zip(df.columns, number_formats(df))):
+            ws.set_column(i, i, COLUMN_WIDTHS.get(header, DEFAULT_COLUMN_WIDTH), formats.get(fmt))
+
+        ws.write_row(0, 0, list(df.columns))
+        for r, row in enumerate(tracked_rows(df, written, total), start=1):
+            ws.write_row(r, 0, row)
+        written += len(df)
+
+        # 全表自动筛选
+        ws.autofilter(0, 0, len(df), max(len(df.columns) - 1, 0))
+
+    workbook.close()
+
+
+# openpyxl 只写模式：不保留已写入的单元格，无需额外依赖
+def _write_openpyxl_write_only(sheets, output):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+    total = sum(len(df) for _, df in sheets)
+    written = 0
+    for sheet_name, df in sheets:
+        ws = workbook.create_sheet(sheet_name)
+
+        for i, header in enumerate(df.columns, start=1):
+            ws.column_dimensions[get_column_letter(i)].width = COLUMN_WIDTHS.get(header, DEFAULT_COLUMN_WIDTH)
+
+        # 全表自动筛选
+        last_col = get_column_letter(max(len(df.columns), 1))
+        ws.auto_filter.ref = f"A1:{last_col}{len(df) + 1}"
+
+        ws.append(list(df.columns))
+
+        formatted_cols = [(i, fmt) for i, fmt in enumerate(number_formats(df)) if fmt]
+        for row in tracked_rows(df, written, total):
+            if formatted_cols:
+                row = list(row)
+                for i, fmt in formatted_cols:
+                    cell = WriteOnlyCell(ws, value=row[i])
+                    cell.number_format = fmt
+                    row[i] = cell
+            ws.append(row)
+        written += len(df)
+
+    workbook.save(output)
+
+
+# 输出为 Excel 字节流
+# engine: "auto" 优先使用 xlsxwriter 常量内存模式，未安装时退回 openpyxl 只写模式；
+# "openpyxl" 为原有的 pandas 写法
+# summary 为 True 时在明细之后追加按人员、部门、日期的汇总表
+@stage("excel_write")
+def build_excel_bytes(df_final, engine="auto", summary=False):
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"未知的 Excel 写入方式：{engine}")
+
+    if engine == "auto":
+        try:
+            import xlsxwriter  # noqa: F401
+            engine = "xlsxwriter"
+        except ImportError:
+            engine = "write_only"
+
+    sheets = [(SHEET_NAME, df_final)]
+    if summary:
+        sheets.extend(summary_tables(df_final).items())
+
+    output = BytesIO()
+    if engine == "xlsxwriter":
+        _write_xlsxwriter(sheets, output)
+    elif engine == "write_only":
+        _write_openpyxl_write_only(sheets, output)
+    else:
+        _write_openpyxl(sheets, output)
+
+    output.seek(0)
+    return output
+
+
+# 输出为 CSV 字节流，带 BOM 以便 Excel 直接打开
+@stage("csv_write")
+def build_csv_bytes(df_final):
+    output = BytesIO()
+    df_final.to_csv(output, index=False, encoding="utf-8-sig")
+    output.seek(0)
+    return output
+
+
+# 输出为 Parquet 字节流，需要安装 pyarrow
+@stage("parquet_write")
+def build_parquet_bytes(df_final):
+    output = BytesIO()
+    df_final.to_parquet(output, index=False)
+    output.seek(0)
+    return output
+
+
+# 按卡户部门拆分结果，返回 [(部门名, DataFrame), ...]，按部门名排序；部门为空的记录归入 UNASSIGNED_DEPARTMENT
+def split_by_department(df_final):
+    department = df_final["卡户部门"].astype(object)
+    key = department.where(department.notna(), UNASSIGNED_DEPARTMENT).astype(str)
+    return list(df_final.groupby(key, sort=True))
+
+
+# 各部门工作簿在 ZIP 中的文件名：替换文件名中不允许的字符，替换后重名的依次加序号
+def workbook_names(departments):
+    names = []
+    used = set()
+    for department in departments:
+        stem = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', "_", department).strip(" ._") or UNASSIGNED_DEPARTMENT
+        name = f"{stem}.xlsx"
+        i = 2
+        while name in used:
+            name = f"{stem}_{i}.xlsx"
+            i += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+# 生成单个部门的工作簿内容（工作进程中执行）
+def _department_workbook(df, engine, summary):
+    return build_excel_bytes(df, engine=engine, summary=summary).getvalue()
+
+
+# 按部门各生成一个工作簿（列宽、自动筛选与整表导出相同），依次写入 ZIP，返回 ZIP 字节流
+# workers > 1 时多进程并行生成；按部门顺序写入，同时在途的工作簿不超过 2 × workers 个，
+# 写入 ZIP 后即释放，不会同时保留所有部门的工作簿
+# output 可传入已打开的文件，直接写入磁盘
+@stage("zip_write")
+def build_department_zip(df_final, workers=1, engine="auto", summary=False, output=None):
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"未知的 Excel 写入方式：{engine}")
+
+    parts = split_by_department(df_final)
+    names = workbook_names([department for department, _ in parts])
+    output = BytesIO() if output is None else output
+
+    # xlsx 本身已压缩，ZIP 中直接存储
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        def write(name, data):
+            archive.writestr(name, data)
+            report_progress("zip_write", len(archive.namelist()), len(parts))
+
+        if workers <= 1 or len(parts) <= 1:
+            for name, (_, df) in zip(names, parts):
+                write(name, _department_workbook(df, engine, summary))
+        else:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(parts)), mp_context=context) as pool:
+                pending = deque()
+                for name, (_, df) in zip(names, parts):
+                    pending.append((name, pool.submit(_department_workbook, df, engine, summary)))
+                    # 在途过多或最早提交的已完成时，先把已完成的依次写入
+                    while len(pending) >= 2 * workers or (pending and pending[0][1].done()):
+                        name, future = pending.popleft()
+                        write(name, future.result())
+                while pending:
+                    name, future = pending.popleft()
+                    write(name, future.result())
+
+    if isinstance(output, BytesIO):
+        output.seek(0)
+    return output
+
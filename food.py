@@ -1,299 +1,259 @@
+import functools
+import hashlib
+import importlib.util
+import io
+import time
 import streamlit as st
 import pandas as pd
-from io import BytesIO
-from datetime import datetime, timedelta
-import chinese_calendar as calendar
-from openpyxl.utils import get_column_letter
-
-
-# 获取指定年份的法定节假日
-def get_holidays(year):
-    holidays = []
-    current_date = datetime(year, 1, 1)
-    end_date = datetime(year, 12, 31)
-
-    while current_date <= end_date:
-        if calendar.is_holiday(current_date):
-            holidays.append(current_date.date())
-        current_date += timedelta(days=1)
-
-    return set(holidays)
-
-
-# 定义餐补时间段
-def get_meal_period(t):
-    if t is None or pd.isna(t):
-        return "其他"
-
-    breakfast_start = pd.to_datetime("07:20:00").time()
-    breakfast_end = pd.to_datetime("09:00:00").time()
-    lunch_start = pd.to_datetime("11:00:00").time()
-    lunch_end = pd.to_datetime("14:00:00").time()
-    dinner_start = pd.to_datetime("17:00:00").time()
-    dinner_end = pd.to_datetime("20:00:00").time()
-
-    if breakfast_start <= t <= breakfast_end:
-        return "早餐"
-    elif lunch_start <= t <= lunch_end:
-        return "午餐"
-    elif dinner_start <= t <= dinner_end:
-        return "晚餐"
-    else:
-        return "其他"
-
-
-# 解析日期输入
-def parse_date_set(text):
-    dates = set()
-    invalid = []
-
-    for part in (text or "").split(","):
-        part = part.strip()
-        if not part:
-            continue
-        try:
-            dates.add(datetime.strptime(part, "%Y-%m-%d").date())
-        except ValueError:
-            invalid.append(part)
-
-    return dates, invalid
-
-
-# 根据人员类别、时段、是否工作日/节假日，确定补贴上限
-def get_max_subsidy(person_type, meal_period, workday, is_holiday):
-    if person_type == "职工":
-        if meal_period == "早餐":
-            return 0.0
-        elif meal_period in ["午餐", "晚餐"] and is_holiday:
-            return 29.0
-        elif meal_period == "午餐" and workday:
-            return 25.0
-        elif meal_period in ["午餐", "晚餐"]:
-            return 29.0
-        else:
-            return 0.0
-
-    elif person_type == "研究生":
-        if meal_period == "早餐" and workday:
-            return 2.0
-        elif meal_period in ["午餐", "晚餐"] and is_holiday:
-            return 29.0
-        elif meal_period == "午餐" and workday:
-            return 25.0
-        elif meal_period in ["午餐", "晚餐"]:
-            return 29.0
-        else:
-            return 0.0
-
-    return 0.0
-
-
-# 计算单个分组的餐补
-def calculate_subsidy_group(group, overtime_dates, holiday_and_high_temp_days):
-    group = group.copy()
-    subsidy_used = 0.0
-
-    # 因为已经按“餐费时间段”分组，所以组内取第一条即可
-    meal_period = group["餐费时间段"].iloc[0]
-
-    for idx, row in group.iterrows():
-        amount = float(row["交易金额"])
-
-        # 超市不参与餐补
-        if row["交易地点"] == "超市":
-            group.at[idx, "餐补金额"] = 0.0
-            group.at[idx, "自付（元）"] = round(amount, 2)
-            group.at[idx, "早餐（元）"] = 0.0
-            group.at[idx, "工作餐（元）"] = 0.0
-            group.at[idx, "加班餐（元）"] = 0.0
-            continue
-
-        trade_time = row["交易时间"]
-        date = trade_time.date()
-        weekday = trade_time.weekday()
-
-        workday = (weekday < 5) or (date in overtime_dates)
-        is_holiday = (date in holiday_and_high_temp_days) and (date not in overtime_dates)
-
-        max_subsidy = get_max_subsidy(
-            person_type=row["人员类别"],
-            meal_period=meal_period,
-            workday=workday,
-            is_holiday=is_holiday,
-        )
-
-        available_subsidy = max(0.0, max_subsidy - subsidy_used)
-        subsidy_given = min(amount, available_subsidy)
-        subsidy_used += subsidy_given
-
-        group.at[idx, "餐补金额"] = round(subsidy_given, 2)
-        group.at[idx, "自付（元）"] = round(amount - subsidy_given, 2)
-
-        # 先清零，再按类别写入
-        group.at[idx, "早餐（元）"] = 0.0
-        group.at[idx, "工作餐（元）"] = 0.0
-        group.at[idx, "加班餐（元）"] = 0.0
-
-        if meal_period == "早餐":
-            group.at[idx, "早餐（元）"] = round(subsidy_given, 2)
-        elif meal_period == "午餐" and (not is_holiday) and workday:
-            group.at[idx, "工作餐（元）"] = round(subsidy_given, 2)
-        elif meal_period in ["午餐", "晚餐"]:
-            group.at[idx, "加班餐（元）"] = round(subsidy_given, 2)
-
-    return group
-
-
-# 读取 CSV，自动尝试编码
-def read_csv_with_fallback(uploaded_file):
-    last_error = None
-    for enc in ("gbk", "gb18030", "utf-8-sig", "utf-8"):
-        try:
-            uploaded_file.seek(0)
-            df = pd.read_csv(uploaded_file, encoding=enc, low_memory=False)
-            return df, enc
-        except Exception as e:
-            last_error = e
-
-    raise last_error
-
-
-# 核心处理逻辑
-def process_dataframe(raw_df, holiday_year, overtime_dates, high_temp_days):
-    required_columns = [
-        "人员类别", "姓名", "个人编号", "卡片类型",
-        "交易地点", "交易金额", "交易时间", "卡户部门", "交易类型"
-    ]
-    missing = [col for col in required_columns if col not in raw_df.columns]
-    if missing:
-        raise ValueError(f"缺少必要列：{', '.join(missing)}")
-
-    df = raw_df[required_columns].copy()
-
-    # 清理字符串列里的空格 / 制表符
-    for col in df.select_dtypes(include=["object"]).columns:
-        df[col] = df[col].map(lambda x: x.strip() if isinstance(x, str) else x)
-
-    # 删除收费冲正
-    df = df[df["交易类型"] != "收费冲正"].copy()
-
-    # 金额转为正数
-    df["交易金额"] = pd.to_numeric(df["交易金额"], errors="coerce").fillna(0).abs()
-
-    # 解析交易时间
-    df["交易时间"] = pd.to_datetime(df["交易时间"], errors="coerce")
-    invalid_time_count = int(df["交易时间"].isna().sum())
-
-    # 删除无法解析时间的记录
-    df = df[df["交易时间"].notna()].copy()
-    if df.empty:
-        raise ValueError("清洗后没有可用数据，请检查“交易时间”列格式。")
-
-    # 生成餐费时间段
-    df["餐费时间段"] = df["交易时间"].dt.time.map(get_meal_period)
-
-    # 初始化新列
-    for col in ["餐补金额", "自付（元）", "早餐（元）", "工作餐（元）", "加班餐（元）"]:
-        df[col] = 0.0
-
-    df["交易日期"] = df["交易时间"].dt.date
-    df = df.sort_values(by=["姓名", "个人编号", "交易日期", "交易时间"]).copy()
-
-    holiday_and_high_temp_days = get_holidays(holiday_year).union(high_temp_days)
-
-    # 不再使用 groupby.apply，直接显式遍历分组，兼容性最好
-    group_cols = ["姓名", "个人编号", "交易日期", "餐费时间段"]
-    result_groups = []
 
-    for _, group in df.groupby(group_cols, sort=False, observed=True):
-        result_groups.append(
-            calculate_subsidy_group(
-                group=group,
-                overtime_dates=overtime_dates,
-                holiday_and_high_temp_days=holiday_and_high_temp_days
-            )
+from export import build_csv_bytes, build_department_zip, build_excel_bytes, build_parquet_bytes
+from history_store import HISTORY_DB, save_history
+from holiday_calendar import build_calendar_index, unsupported_years
+from ingest import input_format
+from instrument import STAGE_LOG, peak_rss_mb, record_stages, summarize_stages
+from jobs import discard, finished, get_job, job_id, store, submit
+from parallel import cpu_count
+from result_cache import load_file_info, load_result, result_cache_key, save_file_info, save_result
+from result_store import process_incremental
+from subsidy import (
+    compute_partitions, data_years, load_partitions,
+    parse_date_set,
+)
+from subsidy_rules import RULES_FILE, load_rules, rules_digest
+from summaries import category_totals, filter_positions, page_of, summary_tables
+
+
+# ---------------- 后台任务与缓存 ----------------
+# 读取、计算和生成 Excel 在后台任务中运行，页面只轮询进度；同一文件、同一参数的任务在多次重跑、
+# 刷新页面和多个会话之间共用（见 jobs.py），计算结果另存磁盘缓存（见 result_cache.py）
+
+# 上传文件内容的摘要，同一次上传只计算一次
+def upload_digest(uploaded_file):
+    digests = st.session_state.setdefault("upload_digests", {})
+    key = getattr(uploaded_file, "file_id", None)
+    if key not in digests:
+        digests[key] = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+    return digests[key]
+
+
+# 读取、清洗并准备上传的文件（后台任务），文件基本信息同时存入磁盘缓存
+# 从文件内容的副本读取，不与页面争用上传文件的读写位置
+def read_upload(file_digest, uploaded_file):
+    with record_stages() as records:
+        partitions, invalid_time_count, used_encoding = load_partitions(
+            io.BytesIO(uploaded_file.getbuffer()), input_format(uploaded_file.name)
         )
+    info = {
+        "invalid_time_count": invalid_time_count,
+        "used_encoding": used_encoding,
+        "years": data_years(partitions),
+    }
+    save_file_info(file_digest, info)
+    return {"partitions": partitions, "info": info, "records": records}
+
+
+# 节假日日历，只与年份和日期集合有关
+@st.cache_resource(max_entries=16, ttl=3600, show_spinner=False)
+def cached_calendar(years, overtime_key, high_temp_key):
+    return build_calendar_index(years, set(overtime_key), set(high_temp_key))
+
+
+# 计算餐补（后台任务），返回页面展示所需的全部内容
+# 先查磁盘缓存，命中时不必读取文件；否则复用已完成的读取任务，没有时在本任务中读取，
+# 并登记为读取任务，之后修改参数时不必再次读取（例如文件信息取自磁盘缓存、未提交读取任务时）
+# 增量处理时统计按天复用 / 重新计算的天数；增量与否不影响结果，不作为磁盘缓存键
+def compute_result(result_key, incremental, uploaded_file, calendar_index, rules, info):
+    file_digest = result_key[0]
+    key = result_cache_key(*result_key)
+    with record_stages() as records:
+        df_final = load_result(key)
+
+    store_stats = None
+    from_disk = df_final is not None
+    if not from_disk:
+        read_key = job_id("read", file_digest)
+        read_job = get_job(read_key)
+        if read_job is not None and read_job["status"] == "done":
+            upload = read_job["result"]
+        else:
+            upload = read_upload(file_digest, uploaded_file)
+            store(read_key, upload)
+
+        with record_stages() as compute_records:
+            if incremental:
+                df_final, store_stats = process_incremental(
+                    upload["partitions"], calendar_index, rules=rules
+                )
+            else:
+                df_final = compute_partitions(
+                    upload["partitions"], calendar_index, rules=rules
+                )
+            save_result(key, df_final)
+        records = upload["records"] + records + compute_records
+
+    return {
+        "result_key": result_key,
+        "info": info,
+        "df_final": df_final,
+        "store_stats": store_stats,
+        "records": records,
+        "from_disk": from_disk,
+    }
+
+
+# 生成 Excel（后台任务），返回文件内容和阶段记录
+def export_excel(df_final, summary):
+    with record_stages() as records:
+        data = build_excel_bytes(df_final, summary=summary).getvalue()
+    return {"data": data, "records": records}
+
+
+# 按部门拆分的 ZIP（后台任务），多进程生成各部门工作簿
+def export_department_zip(df_final, summary, workers):
+    with record_stages() as records:
+        data = build_department_zip(df_final, workers=workers, summary=summary).getvalue()
+    return {"data": data, "records": records}
+
+
+# 其他格式的导出文件内容，与计算结果及格式一一对应
+EXPORT_BUILDERS = {
+    "csv": build_csv_bytes,
+    "parquet": build_parquet_bytes,
+}
+
+
+@st.cache_data(max_entries=8, ttl=3600, show_spinner=False)
+def cached_export(file_digest, overtime_key, high_temp_key, rules_key, fmt, _df_final):
+    return EXPORT_BUILDERS[fmt](_df_final).getvalue()
+
+
+# 会话中某个结果的导出阶段记录：{格式: 记录列表}
+def export_records_for(result_key):
+    return st.session_state.setdefault("export_records", {}).setdefault(result_key, {})
+
+
+# 生成导出文件，并把本次实际生成时的阶段记录存入 export_records（命中缓存时不记录）
+def run_export(result_key, fmt, df_final, export_records):
+    with record_stages() as records:
+        data = cached_export(*result_key, fmt, df_final)
+    if records:
+        export_records[fmt] = records
+    return data
+
+
+# 下载按钮使用的无参回调：点击下载时才生成文件，之后同一结果直接取缓存
+# 回调在脚本之外执行，不能访问 session_state，因此先取出会话中本结果的记录字典再传入
+def deferred_export(result_key, fmt, df_final):
+    export_records = export_records_for(result_key)
+    return functools.partial(run_export, result_key, fmt, df_final, export_records)
+
+
+# 预览用的汇总表，与计算结果一一对应
+@st.cache_data(max_entries=4, ttl=3600, show_spinner=False)
+def cached_summaries(file_digest, overtime_key, high_temp_key, rules_key, _df_final):
+    return {"按类别汇总": category_totals(_df_final), **summary_tables(_df_final)}
+
+
+# 明细筛选结果（满足条件的行位置）
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def cached_filter(file_digest, overtime_key, high_temp_key, rules_key,
+                  keyword, departments, _df_final):
+    return filter_positions(_df_final, keyword, departments)
+
+
+# 分页展示：只把当前页的数据发送到浏览器
+def show_page(df, positions, key, page_sizes=(50, 100, 500)):
+    col_size, col_page, col_info = st.columns([1, 1, 2])
+    page_size = col_size.selectbox("每页行数", page_sizes, key=f"{key}_page_size")
+    page_count = max(1, -(-len(positions) // page_size))
+    # 页数变化时换用新的控件，页码回到第 1 页
+    page = col_page.number_input(
+        "页码", min_value=1, max_value=page_count, value=1, step=1, key=f"{key}_page_{page_count}"
+    )
+    col_info.caption(f"共 {len(positions):,} 行，{page_count:,} 页")
+    st.dataframe(page_of(df, positions, page, page_size), use_container_width=True, hide_index=True)
+
+
+# 各阶段进度的说明
+PROGRESS_LABELS = {
+    "decode": "已读取行数",
+    "subsidy": "已计算行数",
+    "excel_write": "已写入行数",
+    "zip_write": "已完成部门数",
+}
+
+
+# 显示任务进度：已知总数的阶段显示进度条，否则只显示已完成数
+def show_progress(job, label):
+    state = "排队中" if job["status"] == "queued" else "运行中"
+    st.info(f"{label}（{state}，已用时 {time.time() - job['submitted_at']:.0f} 秒）")
+    for name, (done, total) in list(job["progress"].items()):
+        text = f"{PROGRESS_LABELS.get(name, name)}：{done:,}" + (f" / {total:,}" if total else "")
+        if total:
+            st.progress(min(done / total, 1.0), text=text)
+        else:
+            st.caption(text)
 
-    if result_groups:
-        df_result = pd.concat(result_groups, axis=0)
-        df_result = df_result.sort_values(by=["姓名", "个人编号", "交易日期", "交易时间"])
-    else:
-        df_result = df.copy()
-
-    df_final = df_result[
-        ["人员类别", "姓名", "个人编号", "卡片类型", "交易地点", "卡户部门",
-         "交易时间", "交易金额", "早餐（元）", "工作餐（元）", "加班餐（元）", "自付（元）"]
-    ].copy()
-
-    return df_final, invalid_time_count
-
-
-# 输出为 Excel 字节流
-def build_excel_bytes(df_final):
-    output = BytesIO()
 
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df_final.to_excel(writer, index=False, sheet_name="餐补计算结果")
-        ws = writer.book["餐补计算结果"]
+# 轮询未结束的任务：每秒只重新运行这一片段刷新进度，任务结束后重新运行整个页面
+# 返回任务是否已结束
+def poll_job(job, label):
+    if finished(job):
+        return True
 
-        # 全表自动筛选
-        ws.auto_filter.ref = ws.dimensions
+    @st.fragment(run_every=1)
+    def poll():
+        if finished(job):
+            st.rerun()
+        show_progress(job, label)
 
-        width_map = {
-            "人员类别": 10,
-            "姓名": 12,
-            "个人编号": 14,
-            "卡片类型": 12,
-            "交易地点": 16,
-            "卡户部门": 28,
-            "交易时间": 20,
-            "交易金额": 12,
-            "早餐（元）": 12,
-            "工作餐（元）": 12,
-            "加班餐（元）": 12,
-            "自付（元）": 12,
-        }
+    poll()
+    return False
 
-        for i, header in enumerate(df_final.columns, start=1):
-            col_letter = get_column_letter(i)
-            ws.column_dimensions[col_letter].width = width_map.get(header, 13)
 
-    output.seek(0)
-    return output
+# 任务失败时显示错误和重试按钮
+def show_failure(job, message):
+    st.error(f"{message}：{job['error']}")
+    if st.button("重试", key=f"retry_{job['id']}"):
+        discard(job["id"])
+        st.rerun()
 
 
 # ---------------- Streamlit 页面 ----------------
 st.title("餐补计算小程序")
 
-uploaded_file = st.file_uploader("上传 CSV 文件", type=["csv"])
+uploaded_file = st.file_uploader(
+    "上传 CSV / Parquet / Feather / Excel 文件", type=["csv", "parquet", "feather", "arrow", "xlsx"]
+)
 
 if uploaded_file is not None:
-    try:
-        raw_df, used_encoding = read_csv_with_fallback(uploaded_file)
-    except Exception as e:
-        st.error(f"CSV 读取失败：{e}")
-        st.stop()
-
-    # 尝试从数据里自动识别年份，作为默认节假日年份
-    default_year = datetime.now().year
-    if "交易时间" in raw_df.columns:
-        trade_time_preview = pd.to_datetime(
-            raw_df["交易时间"].astype(str).str.strip(),
-            errors="coerce"
+    file_digest = upload_digest(uploaded_file)
+
+    # 文件基本信息优先取磁盘缓存，已处理过的文件不必等待读取
+    info = load_file_info(file_digest)
+    if info is None:
+        read_job = submit(job_id("read", file_digest), read_upload, file_digest, uploaded_file)
+        if not poll_job(read_job, "正在读取文件"):
+            st.stop()
+        if read_job["status"] == "failed":
+            show_failure(read_job, "文件读取失败")
+            st.stop()
+        info = read_job["result"]["info"]
+
+    if input_format(uploaded_file.name) == "csv":
+        source = f"CSV 编码识别：{info['used_encoding']}"
+    else:
+        source = f"文件格式：{info['used_encoding']}"
+    # 节假日按数据中出现的每个年份自动取用，无需另行指定年份
+    years = "、".join(map(str, sorted(info["years"])))
+    st.caption(f"{source} ｜ 节假日年份：{years} ｜ pandas 版本：{pd.__version__}")
+
+    missing_years = unsupported_years(info["years"])
+    if missing_years:
+        st.warning(
+            f"节假日库没有以下年份的数据，这些年份按星期计算（周六、周日算节假日）："
+            f"{', '.join(map(str, missing_years))}"
         )
-        valid_years = trade_time_preview.dropna().dt.year
-        if not valid_years.empty:
-            default_year = int(valid_years.mode().iloc[0])
-
-    st.caption(f"CSV 编码识别：{used_encoding} ｜ pandas 版本：{pd.__version__}")
-
-    holiday_year = st.number_input(
-        "请输入节假日年份",
-        min_value=2000,
-        max_value=2100,
-        value=default_year,
-        step=1
-    )
 
     overtime_dates_input = st.text_input(
         "请输入加班调休日期（格式：YYYY-MM-DD,YYYY-MM-DD,...）",
@@ -313,28 +273,196 @@ if uploaded_file is not None:
     if high_temp_invalid:
         st.warning(f"以下高温假日期格式无效，已忽略：{', '.join(high_temp_invalid)}")
 
+    # 补贴规则表，修改文件后自动重新读取
+    try:
+        rules = load_rules()
+    except (OSError, ValueError) as e:
+        st.error(f"补贴规则表读取失败：{e}")
+        st.stop()
+    rules_key = rules_digest(rules)
+
+    with st.expander("补贴规则"):
+        st.caption(f"规则文件：{RULES_FILE}（按顺序取第一条匹配的规则，留空表示任意）")
+        st.dataframe(rules, use_container_width=True, hide_index=True)
+
+    has_pyarrow = importlib.util.find_spec("pyarrow") is not None
+    with st.expander("计算选项"):
+        # 按天保存计算结果，再次上传同一月份的累计导出时只计算新增或有变动的日期
+        incremental = st.checkbox(
+            "增量处理（复用已保存的按天计算结果）",
+            value=has_pyarrow,
+            disabled=not has_pyarrow,
+            help=None if has_pyarrow else "未安装 pyarrow，无法保存按天计算结果。"
+        )
+
+    # 日期集合转为有序元组，作为缓存键
+    overtime_key = tuple(sorted(overtime_dates))
+    high_temp_key = tuple(sorted(high_temp_days))
+
     try:
-        df_final, invalid_time_count = process_dataframe(
-            raw_df=raw_df,
-            holiday_year=holiday_year,
-            overtime_dates=overtime_dates,
-            high_temp_days=high_temp_days
+        calendar_index = cached_calendar(
+            tuple(sorted(info["years"])), overtime_key, high_temp_key
         )
     except Exception as e:
         st.error(f"处理失败：{e}")
         st.stop()
 
-    if invalid_time_count > 0:
-        st.warning(f"有 {invalid_time_count} 条记录的“交易时间”无法解析，已自动跳过。")
+    result_key = (file_digest, overtime_key, high_temp_key, rules_key)
+    compute_job = submit(
+        job_id("compute", *result_key, incremental), compute_result,
+        result_key, incremental, uploaded_file, calendar_index, rules, info
+    )
+    # 任务编号记在网址中，刷新页面后可重新连接到该任务
+    st.query_params["job"] = compute_job["id"]
+else:
+    compute_job = get_job(st.query_params.get("job", ""))
+    if compute_job is None:
+        st.stop()
+    st.info("已重新连接到之前提交的计算任务；如需修改参数，请重新上传文件。")
+
+if not poll_job(compute_job, "正在计算餐补"):
+    st.stop()
+if compute_job["status"] == "failed":
+    show_failure(compute_job, "处理失败")
+    st.stop()
+
+result = compute_job["result"]
+result_key = result["result_key"]
+df_final = result["df_final"]
+store_stats = result["store_stats"]
+invalid_time_count = result["info"]["invalid_time_count"]
+
+if invalid_time_count > 0:
+    st.warning(f"有 {invalid_time_count} 条记录的“交易时间”无法解析，已自动跳过。")
+
+st.success("✅ 数据处理完成！")
+if result["from_disk"]:
+    st.caption("结果来自磁盘缓存（同一文件、同样参数此前已处理过）")
+if store_stats:
+    st.caption(
+        f"增量处理：复用 {store_stats['reused_days']} 天，"
+        f"重新计算 {store_stats['computed_days']} 天"
+    )
 
-    excel_data = build_excel_bytes(df_final)
+# 预览只发送汇总表和当前页明细，结果行数再多页面也不会卡顿
+summaries = cached_summaries(*result_key, df_final)
+tab_total, tab_person, tab_department, tab_day, tab_detail = st.tabs(
+    ["汇总", "按人员", "按部门", "按日期", "明细"]
+)
+
+with tab_total:
+    category = summaries["按类别汇总"]
+    subsidy_total = category.loc[category["类别"] != "自付", "金额（元）"].sum()
+    col_rows, col_subsidy, col_self = st.columns(3)
+    col_rows.metric("记录数", f"{len(df_final):,}")
+    col_subsidy.metric("餐补合计（元）", f"{subsidy_total:,.2f}")
+    col_self.metric("自付合计（元）", f"{category['金额（元）'].iloc[-1]:,.2f}")
+    st.dataframe(category, use_container_width=True, hide_index=True)
+
+with tab_person:
+    person = summaries["按人员汇总"]
+    show_page(person, range(len(person)), "person")
+
+with tab_department:
+    st.dataframe(summaries["按部门汇总"], use_container_width=True, hide_index=True)
+
+with tab_day:
+    st.dataframe(summaries["按日期汇总"], use_container_width=True, hide_index=True)
+
+with tab_detail:
+    col_keyword, col_department = st.columns(2)
+    keyword = col_keyword.text_input("姓名或个人编号包含")
+    departments = col_department.multiselect(
+        "卡户部门", summaries["按部门汇总"]["卡户部门"].dropna().astype(str).tolist()
+    )
+    positions = cached_filter(*result_key, keyword.strip(), tuple(departments), df_final)
+    show_page(df_final, positions, "detail")
+
+# 汇总表由明细一次分组得到，财务月结时不必再在 Excel 中自行透视
+with_summary = st.checkbox("Excel 中附加按人员、部门、日期的汇总表", value=True)
+
+# Excel 在后台生成，生成期间页面其余部分照常可用；同一结果的 Excel 只生成一次
+excel_key = job_id("excel", *result_key, with_summary)
+excel_job = get_job(excel_key)
+if excel_job is None:
+    if st.button("📄 生成 Excel 文件"):
+        submit(excel_key, export_excel, df_final, with_summary)
+        st.rerun()
+elif poll_job(excel_job, "正在生成 Excel"):
+    if excel_job["status"] == "failed":
+        show_failure(excel_job, "Excel 生成失败")
+    else:
+        export_records_for(result_key)["xlsx"] = excel_job["result"]["records"]
+        st.download_button(
+            "📥 下载 Excel 文件",
+            data=excel_job["result"]["data"],
+            file_name="餐补计算结果.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
+        )
 
-    st.success("✅ 数据处理完成！")
-    st.dataframe(df_final, use_container_width=True)
+with st.expander("其他格式下载"):
+    # 每个卡户部门一个工作簿，打包为 ZIP，便于分发给各部门
+    zip_key = job_id("department_zip", *result_key, with_summary)
+    zip_job = get_job(zip_key)
+    if zip_job is None:
+        if st.button("🗂️ 生成按部门拆分的 Excel（ZIP）"):
+            submit(zip_key, export_department_zip, df_final, with_summary, cpu_count())
+            st.rerun()
+    elif poll_job(zip_job, "正在按部门生成 Excel"):
+        if zip_job["status"] == "failed":
+            show_failure(zip_job, "按部门拆分失败")
+        else:
+            export_records_for(result_key)["department_zip"] = zip_job["result"]["records"]
+            st.download_button(
+                "📥 下载按部门拆分的 Excel（ZIP）",
+                data=zip_job["result"]["data"],
+                file_name="餐补计算结果_按部门.zip",
+                mime="application/zip",
+                on_click="ignore"
+            )
 
     st.download_button(
-        "📥 下载 Excel 文件",
-        data=excel_data,
-        file_name="餐补计算结果.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        "📥 下载 CSV 文件",
+        data=deferred_export(result_key, "csv", df_final),
+        file_name="餐补计算结果.csv",
+        mime="text/csv",
+        on_click="ignore"
+    )
+    if importlib.util.find_spec("pyarrow") is None:
+        st.caption("未安装 pyarrow，无法导出 Parquet。")
+    else:
+        st.download_button(
+            "📥 下载 Parquet 文件",
+            data=deferred_export(result_key, "parquet", df_final),
+            file_name="餐补计算结果.parquet",
+            mime="application/octet-stream",
+            on_click="ignore"
+        )
+
+# 写入历史记录库，供“历史查询”页面跨月份汇总；同一人同一天的记录以最近一次写入为准
+history_key = job_id("history", *result_key)
+history_job = get_job(history_key)
+if history_job is None:
+    if st.button("📚 写入历史记录库", help=f"数据库：{HISTORY_DB}"):
+        submit(history_key, save_history, df_final)
+        st.rerun()
+elif poll_job(history_job, "正在写入历史记录库"):
+    if history_job["status"] == "failed":
+        show_failure(history_job, "写入历史记录库失败")
+    else:
+        st.caption(f"已写入历史记录库 {history_job['result']:,} 行，可在“历史查询”页面查询。")
+
+# 诊断信息：读取、计算（或读取磁盘缓存）为生成当前结果时的记录，导出为本会话最近一次实际生成时的记录
+with st.expander("诊断信息"):
+    export_records = [r for records in export_records_for(result_key).values() for r in records]
+    st.dataframe(
+        summarize_stages(result["records"] + export_records),
+        use_container_width=True,
+        hide_index=True
+    )
+    rss = peak_rss_mb()
+    st.caption(
+        (f"服务进程峰值内存：{rss:.0f} MB ｜ " if rss is not None else "")
+        + (f"阶段日志：{STAGE_LOG}" if STAGE_LOG else "设置环境变量 FOOD_STAGE_LOG 可将各阶段记录写入 JSON 日志")
     )
@@ -0,0 +1,200 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from holiday_calendar import CACHE_DIR
+from instrument import stage
+from summaries import AMOUNT_COLUMNS, SUBSIDY_COLUMNS, aggregate
+
+
+# 历史记录库（SQLite）路径，可通过环境变量 FOOD_HISTORY_DB 指定
+HISTORY_DB = os.environ.get("FOOD_HISTORY_DB", os.path.join(CACHE_DIR, "history.sqlite3"))
+
+# 明细表的列，与计算结果一致，另加交易日期
+DETAIL_COLUMNS = [
+    "人员类别", "姓名", "个人编号", "卡片类型", "交易地点", "卡户部门",
+    "交易时间", "交易日期", "交易金额", "早餐（元）", "工作餐（元）", "加班餐（元）", "自付（元）",
+]
+
+# 每人每天的汇总表的列；跨月份的汇总查询只读这张表，行数约为明细的几十分之一
+DAILY_COLUMNS = ["个人编号", "姓名", "卡户部门", "交易日期", "笔数"] + AMOUNT_COLUMNS
+
+# 汇总查询可用的分组方式
+GROUP_BY = {
+    "person": ["个人编号", "姓名"],
+    "department": ["卡户部门"],
+    "day": ["交易日期"],
+}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS transactions (
+    {", ".join(f'"{col}"' for col in DETAIL_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS transactions_person ON transactions ("个人编号", "交易日期");
+CREATE INDEX IF NOT EXISTS transactions_day ON transactions ("交易日期");
+CREATE INDEX IF NOT EXISTS transactions_department ON transactions ("卡户部门", "交易日期");
+
+CREATE TABLE IF NOT EXISTS daily_totals (
+    {", ".join(f'"{col}"' for col in DAILY_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS daily_person ON daily_totals ("个人编号", "交易日期");
+CREATE INDEX IF NOT EXISTS daily_day ON daily_totals ("交易日期");
+CREATE INDEX IF NOT EXISTS daily_department ON daily_totals ("卡户部门", "交易日期");
+"""
+
+
+# 打开历史记录库，不存在时创建表和索引；多个进程同时写入时等待锁释放
+def connect(db_path=None):
+    db_path = db_path or HISTORY_DB
+    directory = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+# DataFrame 转为逐行元组：日期时间转为文本（按文本比较即按时间先后），空值转为 None
+def to_rows(df):
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            fmt = "%Y-%m-%d" if col == "交易日期" else "%Y-%m-%d %H:%M:%S"
+            df[col] = df[col].dt.strftime(fmt)
+        elif col == "个人编号":
+            df[col] = df[col].astype(str)
+    df = df.astype(object).where(df.notna(), None)
+    return df.itertuples(index=False, name=None)
+
+
+# 写入一份计算结果：先删除库中相同 (个人编号, 交易日期) 的记录再插入，
+# 同一月份重复写入或累计导出再次写入时不会重复计数；返回写入的明细行数
+@stage("history_write")
+def save_history(df_final, db_path=None):
+    detail = df_final.assign(交易日期=df_final["交易时间"].dt.normalize())[DETAIL_COLUMNS]
+    daily = aggregate(df_final).reset_index()[DAILY_COLUMNS]
+    columns = ", ".join(f'"{col}"' for col in DETAIL_COLUMNS)
+    daily_columns = ", ".join(f'"{col}"' for col in DAILY_COLUMNS)
+
+    with closing(connect(db_path)) as conn, conn:
+        conn.execute('CREATE TEMP TABLE incoming ("个人编号", "交易日期")')
+        conn.executemany(
+            "INSERT INTO incoming VALUES (?, ?)",
+            to_rows(daily[["个人编号", "交易日期"]].drop_duplicates()),
+        )
+        for table in ("transactions", "daily_totals"):
+            conn.execute(
+                f'DELETE FROM {table} WHERE ("个人编号", "交易日期") IN '
+                f'(SELECT "个人编号", "交易日期" FROM incoming)'
+            )
+        conn.executemany(
+            f"INSERT INTO transactions ({columns}) VALUES ({', '.join('?' * len(DETAIL_COLUMNS))})",
+            to_rows(detail),
+        )
+        conn.executemany(
+            f"INSERT INTO daily_totals ({daily_columns}) VALUES ({', '.join('?' * len(DAILY_COLUMNS))})",
+            to_rows(daily),
+        )
+    return len(detail)
+
+
+# 日期范围、个人编号、部门条件，返回 (WHERE 子句, 参数)；条件为空表示不限
+def where_clause(start=None, end=None, person=None, department=None):
+    conditions = []
+    params = []
+    for sql, value in [
+        ('"交易日期" >= ?', start),
+        ('"交易日期" <= ?', end),
+        ('"个人编号" = ?', person),
+        ('"卡户部门" = ?', department),
+    ]:
+        if value not in (None, ""):
+            conditions.append(sql)
+            params.append(str(value))
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+# 按人员、部门或日期汇总任意日期范围（含首尾两天），列与 summaries.summary_tables 一致
+def query_totals(by="person", start=None, end=None, person=None, department=None, db_path=None):
+    if by not in GROUP_BY:
+        raise ValueError(f"未知的汇总方式：{by}")
+
+    keys = ", ".join(f'"{col}"' for col in GROUP_BY[by])
+    sums = ", ".join(f'SUM("{col}") AS "{col}"' for col in ["笔数"] + AMOUNT_COLUMNS)
+    where, params = where_clause(start, end, person, department)
+    sql = f"SELECT {keys}, {sums} FROM daily_totals{where} GROUP BY {keys} ORDER BY {keys}"
+
+    with closing(connect(db_path)) as conn:
+        summary = pd.read_sql_query(sql, conn, params=params)
+
+    summary["笔数"] = summary["笔数"].astype("int64")
+    summary["餐补合计（元）"] = summary[SUBSIDY_COLUMNS].sum(axis=1)
+    money = AMOUNT_COLUMNS + ["餐补合计（元）"]
+    summary[money] = summary[money].round(2)
+    return summary
+
+
+# 查询明细，按交易时间排序；limit 为最多返回的行数
+def query_transactions(start=None, end=None, person=None, department=None, limit=10_000, db_path=None):
+    where, params = where_clause(start, end, person, department)
+    sql = f'SELECT * FROM transactions{where} ORDER BY "交易时间" LIMIT ?'
+    with closing(connect(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params + [int(limit)])
+
+
+# 库中已有数据的日期范围，库为空时为 (None, None)
+def stored_date_range(db_path=None):
+    with closing(connect(db_path)) as conn:
+        return conn.execute('SELECT MIN("交易日期"), MAX("交易日期") FROM daily_totals').fetchone()
+
+
+# 命令行参数
+def build_parser():
+    parser = argparse.ArgumentParser(description="查询历史记录库：按人员、部门或日期汇总任意日期范围的餐补。")
+    parser.add_argument("--by", choices=list(GROUP_BY), default="person",
+                        help="汇总方式：person 按人员、department 按部门、day 按日期（默认 person）")
+    parser.add_argument("--start", default=None, help="开始日期 YYYY-MM-DD（含当天，默认不限）")
+    parser.add_argument("--end", default=None, help="结束日期 YYYY-MM-DD（含当天，默认不限）")
+    parser.add_argument("--person", default=None, help="只查询该个人编号")
+    parser.add_argument("--department", default=None, help="只查询该卡户部门")
+    parser.add_argument("--detail", action="store_true", help="输出明细而不是汇总")
+    parser.add_argument("--db", default=None, help=f"历史记录库路径（默认 {HISTORY_DB}）")
+    parser.add_argument("-o", "--output", default=None, help="结果另存为 CSV 文件")
+    return parser
+
+
+# 查询入口：输出查询结果，返回进程退出码
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    for value in (args.start, args.end):
+        if value:
+            try:
+                pd.Timestamp(value)
+            except ValueError:
+                parser.error(f"日期格式无效：{value}")
+
+    started = time.perf_counter()
+    if args.detail:
+        result = query_transactions(args.start, args.end, args.person, args.department, db_path=args.db)
+    else:
+        result = query_totals(args.by, args.start, args.end, args.person, args.department, db_path=args.db)
+    elapsed = time.perf_counter() - started
+
+    if args.output:
+        result.to_csv(args.output, index=False, encoding="utf-8-sig")
+    else:
+        with pd.option_context("display.max_rows", 200, "display.width", 200):
+            print(result.to_string(index=False))
+    print(f"共 {len(result)} 行，查询用时 {elapsed * 1000:.1f} 毫秒", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
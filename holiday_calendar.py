@@ -0,0 +1,148 @@
+import os
+import warnings
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from instrument import stage
+
+
+# 日历缓存目录，可通过环境变量 FOOD_CACHE_DIR 指定
+CACHE_DIR = os.environ.get(
+    "FOOD_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "food")
+)
+
+
+# chinese_calendar 的版本号；用到日历时才导入，批处理和页面启动时不加载
+@lru_cache(maxsize=1)
+def calendar_version():
+    import chinese_calendar as calendar
+
+    return calendar.__version__
+
+
+# chinese_calendar 是否有该年份的节假日数据（只支持有限的年份范围）
+@lru_cache(maxsize=256)
+def holiday_data_available(year):
+    import chinese_calendar as calendar
+
+    try:
+        calendar.is_holiday(date(year, 1, 1))
+    except NotImplementedError:
+        return False
+    return True
+
+
+# 数据中没有节假日数据的年份，这些年份按星期计算
+def unsupported_years(years):
+    return sorted(y for y in years if not holiday_data_available(int(y)))
+
+
+# 单个年份的全部日期
+def year_days(year):
+    return pd.date_range(date(year, 1, 1), date(year, 12, 31), freq="D")
+
+
+# 单个年份的基础分类：星期、法定节假日（含周末）、调休上班
+# 结果按 chinese_calendar 版本缓存到磁盘，版本升级后自动重建
+# chinese_calendar 没有该年份的数据时给出警告，按星期计算（周六、周日算节假日，没有调休），不写入缓存
+@lru_cache(maxsize=32)
+def load_year_table(year):
+    days = year_days(year)
+    weekday = days.weekday.to_numpy(dtype="int8")
+    if not holiday_data_available(year):
+        warnings.warn(f"chinese_calendar 没有 {year} 年的节假日数据，该年按星期计算（周六、周日算节假日）。")
+        table = np.stack([weekday, (weekday >= 5).astype("int8"), np.zeros_like(weekday)])
+        table.setflags(write=False)
+        return table
+
+    path = os.path.join(CACHE_DIR, f"calendar_{year}_{calendar_version()}.npy")
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+
+    import chinese_calendar as calendar
+
+    holiday = np.array([calendar.is_holiday(d) for d in days.date], dtype="int8")
+    adjusted_workday = ((weekday >= 5) & (holiday == 0)).astype("int8")
+    table = np.stack([weekday, holiday, adjusted_workday])
+    table.setflags(write=False)
+
+    # 先写临时文件再替换，避免并发读取到写了一半的缓存
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, table)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+    return table
+
+
+# 构建覆盖指定年份的逐日分类表，并叠加加班调休、高温假
+@stage("calendar")
+def build_calendar_index(years, overtime_dates, high_temp_days):
+    years = sorted({int(y) for y in years})
+    if not years:
+        raise ValueError("没有可用的年份，无法构建节假日日历。")
+
+    # 只覆盖给定的年份；年份连续时可按天数偏移直接定位，否则按日期查找
+    table = np.concatenate([load_year_table(y) for y in years], axis=1)
+    days = pd.DatetimeIndex(np.concatenate([year_days(y).to_numpy() for y in years]), name="日期")
+
+    overtime = days.isin(pd.to_datetime(sorted(overtime_dates)))
+    high_temp = days.isin(pd.to_datetime(sorted(high_temp_days)))
+    holiday = table[1].astype(bool)
+
+    return pd.DataFrame(
+        {
+            "星期": table[0],
+            "节假日": holiday,
+            "调休上班": table[2].astype(bool),
+            "加班调休": overtime,
+            "高温假": high_temp,
+            # 与原有规则一致：周一至周五或加班调休日算工作日；
+            # 节假日/高温假且非加班调休日算放假
+            "工作日": (table[0] < 5) | overtime,
+            "放假": (holiday | high_temp) & ~overtime,
+        },
+        index=days,
+    )
+
+
+# 按交易时间逐行查表，返回与 trade_time 对齐的分类结果
+def lookup_calendar(calendar_index, trade_time):
+    index = calendar_index.index.to_numpy().astype("datetime64[D]")
+    days = trade_time.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+
+    if (index[-1] - index[0]).astype("int64") == len(index) - 1:
+        positions = (days - index[0]).astype("int64")
+        missing = len(positions) and (positions.min() < 0 or positions.max() >= len(index))
+    else:
+        positions = np.searchsorted(index, days)
+        found = index[np.minimum(positions, len(index) - 1)] == days
+        missing = not found.all()
+
+    if missing:
+        raise ValueError("交易日期超出节假日日历范围。")
+
+    result = calendar_index.iloc[positions]
+    result.index = trade_time.index
+    return result
+
+
+# 日历中的节假日及高温假日期集合
+def holiday_date_set(calendar_index):
+    flags = calendar_index["节假日"] | calendar_index["高温假"]
+    return set(calendar_index.index[flags.to_numpy()].date)
+
+
+# 日历中的加班调休日期集合
+def overtime_date_set(calendar_index):
+    return set(calendar_index.index[calendar_index["加班调休"].to_numpy()].date)
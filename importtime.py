@@ -0,0 +1,154 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# 只在用到时才导入的重型依赖：处理核心（批处理、计算、历史查询）导入后都不应出现
+CORE_DEFERRED = ("streamlit", "openpyxl", "chinese_calendar", "xlsxwriter")
+
+# 页面本身需要 streamlit，其余依赖同样推迟到对应阶段
+APP_DEFERRED = ("openpyxl", "chinese_calendar", "xlsxwriter")
+
+# 检查对象：(模块名或页面脚本, 导入耗时预算（毫秒）, 导入后不应加载的模块)
+# 页面脚本导入即运行，只检查其顶层 import 语句
+TARGETS = [
+    ("subsidy", 600, CORE_DEFERRED),
+    ("batch", 600, CORE_DEFERRED),
+    ("history_store", 600, CORE_DEFERRED),
+    ("result_cache", 600, CORE_DEFERRED),
+    ("food.py", 1500, APP_DEFERRED),
+    (os.path.join("pages", "历史查询.py"), 1500, APP_DEFERRED),
+]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MARKER = "-- import check start --"
+
+# 子进程中运行：计时导入，输出耗时和已加载的模块
+PROBE = """
+import json, sys, time
+print({marker!r}, file=sys.stderr, flush=True)
+started = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+# 页面脚本的顶层 import 语句（不含函数内的延迟导入）
+def script_imports(path):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in nodes)
+
+
+# 解析 -X importtime 的输出，按顶层包汇总自身耗时（毫秒），只统计标记之后的导入
+def parse_importtime(stderr):
+    lines = stderr.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+
+    packages = defaultdict(float)
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        packages[name.split(".")[0]] += int(parts[0]) / 1000
+    return dict(packages)
+
+
+# 在新的解释器中导入一次，返回 (导入耗时秒数, 各顶层包耗时, 已加载的模块)
+def measure_once(target):
+    if target.endswith(".py"):
+        imports = script_imports(os.path.join(BASE_DIR, target))
+    else:
+        imports = f"import {target}"
+
+    code = PROBE.format(marker=MARKER, imports=imports)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True, encoding="utf-8",
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {target} 失败：\n{proc.stderr[-2000:]}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result["seconds"], parse_importtime(proc.stderr), set(result["modules"])
+
+
+# 多次测量取最快的一次，减少磁盘缓存和系统负载的影响
+def measure(target, budget_ms, deferred, runs=3):
+    best = min((measure_once(target) for _ in range(runs)), key=lambda r: r[0])
+    seconds, packages, modules = best
+    loaded = [name for name in deferred if name in modules]
+    return {
+        "target": target,
+        "ms": seconds * 1000,
+        "budget_ms": budget_ms,
+        "packages": packages,
+        "loaded_deferred": loaded,
+        "ok": seconds * 1000 <= budget_ms and not loaded,
+    }
+
+
+# 以表格形式输出导入耗时和耗时最多的包
+def format_report(result, top=8):
+    status = "OK" if result["ok"] else "超出预算" if not result["loaded_deferred"] else "提前加载"
+    lines = [f"== {result['target']}：{result['ms']:.0f} ms（预算 {result['budget_ms']} ms）{status}"]
+    packages = sorted(result["packages"].items(), key=lambda item: item[1], reverse=True)
+    for name, ms in packages[:top]:
+        lines.append(f"  {name:<24}{ms:>10.1f} ms")
+    if result["loaded_deferred"]:
+        lines.append(f"  不应在导入时加载：{', '.join(result['loaded_deferred'])}")
+    return "\n".join(lines)
+
+
+# 命令行参数
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="测量各入口的导入耗时（基于 python -X importtime），超出预算或提前加载重型依赖时返回非零。"
+    )
+    parser.add_argument("targets", nargs="*",
+                        help="只检查这些模块或页面脚本（默认检查全部入口）")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="统一的导入耗时预算（毫秒），默认按入口分别设定")
+    parser.add_argument("--runs", type=int, default=3, help="每个入口测量次数，取最快一次（默认 3）")
+    parser.add_argument("--top", type=int, default=8, help="列出耗时最多的包的个数")
+    parser.add_argument("--json", default=None, help="将结果写入 JSON 文件")
+    return parser
+
+
+# 检查入口：逐个入口在新的解释器中测量
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    targets = TARGETS
+    if args.targets:
+        known = {target: (budget, deferred) for target, budget, deferred in TARGETS}
+        targets = [
+            (target, *known.get(target, (600, CORE_DEFERRED))) for target in args.targets
+        ]
+
+    results = []
+    for target, budget_ms, deferred in targets:
+        if args.budget_ms is not None:
+            budget_ms = args.budget_ms
+        result = measure(target, budget_ms, deferred, max(args.runs, 1))
+        results.append(result)
+        print(format_report(result, args.top), flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
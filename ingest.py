@@ -0,0 +1,331 @@
+import codecs
+import os
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrument import report_progress, stage
+
+
+# 处理所需的列
+REQUIRED_COLUMNS = [
+    "人员类别", "姓名", "个人编号", "卡片类型",
+    "交易地点", "交易金额", "交易时间", "卡户部门", "交易类型"
+]
+
+# 重复值很多的列按分类读取，只存类别编号；个人编号先按文本读取，全部读完后再统一推断类型，
+# 交易金额交给 read_csv 自行解析，异常值在清洗阶段按原逻辑处理
+COLUMN_DTYPES = {
+    "人员类别": "category",
+    "姓名": str,
+    "个人编号": str,
+    "卡片类型": "category",
+    "交易地点": "category",
+    "交易时间": str,
+    "卡户部门": "category",
+    "交易类型": "category",
+}
+
+ENCODINGS = ("gbk", "gb18030", "utf-8-sig", "utf-8")
+
+# 支持的上传文件格式：扩展名 -> 格式
+INPUT_FORMATS = {
+    "csv": "csv",
+    "parquet": "parquet",
+    "feather": "feather",
+    "arrow": "feather",
+    "xlsx": "xlsx",
+}
+
+# 编码识别的采样字节数、每块行数、每个分区的目标字节数
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 200_000
+PARTITION_BYTES = 64 * 1024 * 1024
+
+
+# 从文件开头采样识别编码，按原有顺序取第一个能解码的编码
+def detect_encoding(uploaded_file, sample_size=SAMPLE_SIZE):
+    uploaded_file.seek(0)
+    sample = uploaded_file.read(sample_size)
+    uploaded_file.seek(0)
+
+    for enc in ENCODINGS:
+        # 增量解码，采样末尾被截断的多字节字符不算错误
+        decoder = codecs.getincrementaldecoder(enc)()
+        try:
+            decoder.decode(sample, final=len(sample) < sample_size)
+            return enc
+        except UnicodeDecodeError:
+            continue
+
+    return ENCODINGS[0]
+
+
+# 候选编码：先用指定或识别出的编码，失败后再按原有顺序依次尝试
+def candidate_encodings(uploaded_file, preferred=None):
+    first = preferred or detect_encoding(uploaded_file)
+    return [first] + [enc for enc in ENCODINGS if enc != first]
+
+
+# 分块读取所需列
+def read_csv_chunks(uploaded_file, encoding, chunksize=CHUNK_SIZE, columns=None):
+    columns = set(columns or REQUIRED_COLUMNS)
+    uploaded_file.seek(0)
+    return pd.read_csv(
+        uploaded_file,
+        encoding=encoding,
+        usecols=lambda c: c in columns,
+        dtype={k: v for k, v in COLUMN_DTYPES.items() if k in columns},
+        chunksize=chunksize,
+    )
+
+
+# 个人编号转为数值：只解析不同的取值，再按编号展开；有无法转换的取值时抛出 ValueError / TypeError
+def numeric_person_ids(series):
+    codes, uniques = pd.factorize(series)
+    if not len(uniques):
+        return pd.Series(float("nan"), index=series.index, name=series.name)
+    values = pd.to_numeric(pd.Series(uniques, dtype=object))
+    if (codes < 0).any():
+        values = values.astype("float64")
+    return pd.Series(values.to_numpy()[codes], index=series.index, name=series.name).where(codes >= 0)
+
+
+# 个人编号是否全部为数字（空值除外）
+def person_ids_numeric(series):
+    try:
+        pd.to_numeric(pd.Series(series.dropna().unique(), dtype=object))
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+# 交易时间中出现的年份（取各值的前四位，支持的时间格式都以年份开头），读取时顺便收集，用于先行构建日历
+# 无效值可能带来多余的年份，不以年份开头的值则会遗漏，使用时需再按解析后的交易时间核对
+def leading_years(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        heads = series.dt.year.dropna().unique()
+    else:
+        heads = pd.to_numeric(series.dropna().astype("str").str[:4].unique(), errors="coerce")
+    return {int(y) for y in heads if 1900 <= y <= 2100}
+
+
+# 个人编号全部为数字时转为数值，与一次性读取整个文件时的类型推断一致
+def restore_person_id(df):
+    if "个人编号" not in df.columns:
+        return df
+    try:
+        df["个人编号"] = numeric_person_ids(df["个人编号"])
+    except (ValueError, TypeError):
+        pass
+    return df
+
+
+# 合并多个数据块，分类列先统一类别，避免合并后退化为字符串列
+def concat_frames(frames):
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+
+    frames = [frame.copy(deep=False) for frame in frames]
+    for col in frames[0].columns:
+        if not all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        categories = union_categoricals([frame[col] for frame in frames]).categories
+        for frame in frames:
+            frame[col] = frame[col].cat.set_categories(categories)
+
+    return pd.concat(frames, axis=0)
+
+
+# 读取整个 CSV（只含所需列），自动尝试编码
+@stage("decode")
+def read_csv_with_fallback(uploaded_file):
+    last_error = None
+    for enc in candidate_encodings(uploaded_file):
+        try:
+            df = concat_frames(read_csv_chunks(uploaded_file, enc))
+            return restore_person_id(df), enc
+        except Exception as e:
+            last_error = e
+
+    raise last_error
+
+
+# 文件大小，用于确定分区数
+def file_size(uploaded_file):
+    uploaded_file.seek(0, os.SEEK_END)
+    size = uploaded_file.tell()
+    uploaded_file.seek(0)
+    return size
+
+
+# 分块读取 CSV，按个人编号哈希拆分到临时分区文件，返回 (分区文件列表, 个人编号是否全部为数字, 交易时间中的年份)
+# 同一人的所有记录落在同一分区，因此分区内不会拆开任何“人-日-餐段”分组；
+# 个人编号的类型按整个文件的全部取值确定，与一次性读取整个文件时一致
+@stage("decode")
+def _spill_partitions(uploaded_file, encoding, chunksize, partition_count, spill_dir):
+    paths = [os.path.join(spill_dir, f"part_{i}.pkl") for i in range(partition_count)]
+    files = [open(path, "wb") for path in paths]
+    rows = 0
+    numeric_ids = True
+    years = set()
+    try:
+        for chunk in read_csv_chunks(uploaded_file, encoding, chunksize):
+            rows += len(chunk)
+            report_progress("decode", rows)
+            numeric_ids = numeric_ids and "个人编号" in chunk.columns and person_ids_numeric(chunk["个人编号"])
+            if "交易时间" in chunk.columns:
+                years |= leading_years(chunk["交易时间"])
+            if partition_count == 1 or "个人编号" not in chunk.columns:
+                pickle.dump(chunk, files[0], protocol=pickle.HIGHEST_PROTOCOL)
+                continue
+
+            key = chunk["个人编号"].str.strip()
+            bucket = pd.util.hash_pandas_object(key, index=False).to_numpy() % partition_count
+            for i, part in chunk.groupby(bucket, sort=False):
+                pickle.dump(part, files[i], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+
+    return paths, numeric_ids, years
+
+
+# 依次读取每个分区，分区内保持原文件中的行顺序；numeric_ids 为 True 时个人编号转为数值
+def _load_partitions(paths, numeric_ids=False):
+    for path in paths:
+        frames = []
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))
+                except EOFError:
+                    break
+        if frames:
+            frame = concat_frames(frames)
+            yield restore_person_id(frame) if numeric_ids else frame
+
+
+# 分区读取 CSV：返回识别出的编码、逐个分区产出 DataFrame 的迭代器和交易时间中的年份（见 leading_years）
+# 小文件只有一个分区；离开 with 语句后临时文件自动删除
+@contextmanager
+def partition_csv(uploaded_file, encoding=None, chunksize=CHUNK_SIZE, partition_bytes=PARTITION_BYTES):
+    partition_count = max(1, -(-file_size(uploaded_file) // partition_bytes))
+    spill_dir = tempfile.mkdtemp(prefix="food_ingest_")
+
+    try:
+        last_error = None
+        for enc in candidate_encodings(uploaded_file, encoding):
+            try:
+                paths, numeric_ids, years = _spill_partitions(
+                    uploaded_file, enc, chunksize, partition_count, spill_dir
+                )
+                break
+            except Exception as e:
+                last_error = e
+        else:
+            raise last_error
+
+        yield enc, _load_partitions(paths, numeric_ids), years
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+# 按文件扩展名判断格式，无法识别时按 CSV 处理
+def input_format(file_name):
+    ext = os.path.splitext(file_name or "")[1].lower().lstrip(".")
+    return INPUT_FORMATS.get(ext, "csv")
+
+
+# 转为文本列，空值保持为空（不变成字符串 "nan"）
+def to_text(series):
+    if pd.api.types.is_string_dtype(series.dtype) and not pd.api.types.is_object_dtype(series.dtype):
+        return series
+    return series.astype(str).where(series.notna())
+
+
+# 把列式文件、Excel 读出的数据统一成与分块读取 CSV 时相同的列类型：
+# 分类列转为分类，其余文本列转为文本；已是时间类型的交易时间保持不变，交给清洗阶段处理
+def normalize_frame(df):
+    for col, dtype in COLUMN_DTYPES.items():
+        if col not in df.columns:
+            continue
+        if dtype == "category":
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = to_text(df[col]).astype("category")
+        elif not (col == "交易时间" and pd.api.types.is_datetime64_any_dtype(df[col])):
+            df[col] = to_text(df[col])
+    return df
+
+
+# 读取 Parquet，只读取所需列
+@stage("decode")
+def read_parquet_frame(uploaded_file):
+    import pyarrow.parquet as pq
+
+    uploaded_file.seek(0)
+    names = pq.ParquetFile(uploaded_file).schema_arrow.names
+    uploaded_file.seek(0)
+    df = pd.read_parquet(uploaded_file, columns=[c for c in REQUIRED_COLUMNS if c in names])
+    return normalize_frame(df)
+
+
+# 读取 Feather（Arrow IPC 文件），只读取所需列
+@stage("decode")
+def read_feather_frame(uploaded_file):
+    import pyarrow.ipc as ipc
+
+    uploaded_file.seek(0)
+    names = ipc.open_file(uploaded_file).schema.names
+    uploaded_file.seek(0)
+    df = pd.read_feather(uploaded_file, columns=[c for c in REQUIRED_COLUMNS if c in names])
+    return normalize_frame(df)
+
+
+# 读取 Excel 第一个工作表；pandas 以 openpyxl 只读模式逐行读取，只保留所需列
+@stage("decode")
+def read_excel_frame(uploaded_file):
+    columns = set(REQUIRED_COLUMNS)
+    uploaded_file.seek(0)
+    df = pd.read_excel(
+        uploaded_file,
+        engine="openpyxl",
+        usecols=lambda c: c in columns,
+        dtype={k: str for k, v in COLUMN_DTYPES.items() if v is str and k != "交易时间"},
+    )
+    return normalize_frame(df)
+
+
+COLUMNAR_READERS = {
+    "parquet": read_parquet_frame,
+    "feather": read_feather_frame,
+    "xlsx": read_excel_frame,
+}
+
+
+# 读取任意支持格式的整个文件，返回 (DataFrame, 说明)；CSV 的说明为识别出的编码，其余为格式名
+def read_input_frame(uploaded_file, file_format="csv"):
+    if file_format == "csv":
+        return read_csv_with_fallback(uploaded_file)
+    df = restore_person_id(COLUMNAR_READERS[file_format](uploaded_file))
+    report_progress("decode", len(df))
+    return df, file_format
+
+
+# 按格式打开上传文件：返回 (编码或格式名, 逐个分区产出原始 DataFrame 的迭代器, 交易时间中的年份)
+# CSV 分区读取（见 partition_csv）；Parquet / Feather / Excel 只读取所需列，整体读入作为一个分区
+@contextmanager
+def open_partitions(uploaded_file, file_format="csv", encoding=None, chunksize=CHUNK_SIZE):
+    if file_format == "csv":
+        with partition_csv(uploaded_file, encoding=encoding, chunksize=chunksize) as opened:
+            yield opened
+        return
+
+    df, label = read_input_frame(uploaded_file, file_format)
+    years = leading_years(df["交易时间"]) if "交易时间" in df.columns else set()
+    yield label, iter([df]), years
@@ -0,0 +1,143 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+
+# 各阶段耗时的结构化日志（JSON Lines），设置环境变量 FOOD_STAGE_LOG 为文件路径即开启
+STAGE_LOG = os.environ.get("FOOD_STAGE_LOG")
+
+# 当前线程 / 上下文中正在收集的阶段记录；为 None 且未开启日志时，各阶段不做任何测量
+_records = contextvars.ContextVar("food_stage_records", default=None)
+
+# 当前上下文中正在收集的进度：{阶段: (已完成数, 总数或 None)}；为 None 时不记录
+_progress = contextvars.ContextVar("food_progress", default=None)
+_log_lock = threading.Lock()
+
+
+# 当前进程的峰值内存（MB）；Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+# 在 with 语句内收集各阶段记录，产出记录列表
+@contextmanager
+def record_stages():
+    records = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+# 在 with 语句内收集各阶段进度，产出进度字典；其他线程可随时读取该字典展示进度
+@contextmanager
+def track_progress(progress=None):
+    progress = {} if progress is None else progress
+    token = _progress.set(progress)
+    try:
+        yield progress
+    finally:
+        _progress.reset(token)
+
+
+# 报告某阶段的进度（如已读取行数、已计算行数、已写入行数），未在收集进度时不做任何事
+def report_progress(name, done, total=None):
+    progress = _progress.get()
+    if progress is not None:
+        progress[name] = (done, total)
+
+
+# 追加一行 JSON 日志
+def write_log(record):
+    line = json.dumps(
+        {"time": datetime.now().isoformat(timespec="milliseconds"), "pid": os.getpid(), **record},
+        ensure_ascii=False,
+        default=str,
+    )
+    with _log_lock, open(STAGE_LOG, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+# 参数或返回值中的行数：DataFrame 取行数，元组取第一个元素，DataFrame 列表取总行数，其他情况为空
+def count_rows(value):
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, list) and value and all(isinstance(v, pd.DataFrame) for v in value):
+        return sum(len(v) for v in value)
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+
+# 记录一个阶段的耗时、输入输出行数和峰值内存增量
+# 峰值内存取进程级最高值，只有本阶段刷新了最高值时增量才大于 0
+def stage(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            records = _records.get()
+            if records is None and not STAGE_LOG:
+                return func(*args, **kwargs)
+
+            record = {"stage": name, "rows_in": count_rows(args[0]) if args else None}
+            rss_before = peak_rss_mb()
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                record["rows_out"] = count_rows(result)
+                return result
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                record["seconds"] = time.perf_counter() - started
+                rss_after = peak_rss_mb()
+                if rss_after is not None:
+                    record["peak_rss_mb"] = rss_after
+                    record["peak_rss_delta_mb"] = rss_after - rss_before
+                if records is not None:
+                    records.append(record)
+                if STAGE_LOG:
+                    write_log(record)
+        return wrapper
+    return decorator
+
+
+# 按阶段汇总记录（同一阶段可能按分区执行多次），用于页面展示
+def summarize_stages(records):
+    if not records:
+        return pd.DataFrame(columns=["阶段", "次数", "耗时（秒）", "输入行数", "输出行数", "峰值内存增量（MB）"])
+
+    df = pd.DataFrame(records)
+    for col in ["rows_in", "rows_out", "peak_rss_delta_mb"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce") if col in df.columns else float("nan")
+
+    # 全部为空时保持为空，而不是 0
+    def total(values):
+        return values.sum(min_count=1)
+
+    summary = df.groupby("stage", sort=False).agg(
+        次数=("stage", "size"),
+        耗时=("seconds", "sum"),
+        输入行数=("rows_in", total),
+        输出行数=("rows_out", total),
+        峰值内存增量=("peak_rss_delta_mb", total),
+    )
+    summary[["输入行数", "输出行数"]] = summary[["输入行数", "输出行数"]].astype("Int64")
+    return summary.reset_index().rename(columns={
+        "stage": "阶段", "耗时": "耗时（秒）", "峰值内存增量": "峰值内存增量（MB）"
+    })
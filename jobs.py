@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from instrument import track_progress
+
+
+# 后台任务的工作线程数，可通过环境变量 FOOD_JOB_WORKERS 指定；
+# 超出时新任务排队等待，不会拖慢正在运行的任务
+JOB_WORKERS = int(os.environ.get("FOOD_JOB_WORKERS", "2"))
+
+# 已完成任务的结果最多占用的内存（MB），可通过环境变量 FOOD_JOB_MEMORY_MB 指定；
+# 超出时按最近使用时间淘汰，最近用过的一个任务总会保留
+JOB_MEMORY_MB = int(os.environ.get("FOOD_JOB_MEMORY_MB", "1024"))
+
+# 已完成任务最多保留的个数；超过时长（秒）未被使用的任务也会淘汰
+# 失败的任务不占内存，只按时长淘汰，在此之前保留错误信息直到用户点击重试
+FINISHED_JOBS = 64
+JOB_TTL = 3600
+
+# 任务登记表：{任务编号: 任务}，同一进程内所有会话共用
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+
+
+# 任务编号：由任务类型和全部输入决定，同样的输入只运行一次，刷新页面或其他人提交时直接复用
+def job_id(*key):
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="food-job")
+    return _executor
+
+
+# 任务结果大致占用的内存（字节）：统计其中的 DataFrame、Series 和文件内容
+def result_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(result_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_size(v) for v in value)
+    return 0
+
+
+# 淘汰已结束的任务，调用时须持有 _lock：
+# 超时未使用的都删除；已完成的任务按最近使用时间从早到晚删除，直到个数和内存占用都不超出
+def _expire():
+    now = time.time()
+    for job in list(_jobs.values()):
+        if job["finished_at"] is not None and now - job["used_at"] > JOB_TTL:
+            del _jobs[job["id"]]
+
+    done = sorted(
+        (job for job in _jobs.values() if job["status"] == "done"),
+        key=lambda job: job["used_at"],
+    )
+    total = sum(job["size"] for job in done)
+    for job in done[:-1]:
+        if len(done) <= FINISHED_JOBS and total <= JOB_MEMORY_MB * 1024 * 1024:
+            break
+        del _jobs[job["id"]]
+        done.remove(job)
+        total -= job["size"]
+
+
+# 提交后台任务；同编号的任务已存在时直接返回该任务（失败的任务需先 discard 或超时淘汰后才会重新运行）
+# 任务为字典：status 为 queued / running / done / failed，progress 为各阶段进度，
+# 结束后 result 为返回值，出错时 error 为错误信息
+def submit(key, func, *args, **kwargs):
+    with _lock:
+        _expire()
+        job = _jobs.get(key)
+        if job is not None:
+            job["used_at"] = time.time()
+            return job
+
+        job = {
+            "id": key,
+            "status": "queued",
+            "progress": {},
+            "result": None,
+            "error": None,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "used_at": time.time(),
+            "size": 0,
+        }
+        _jobs[key] = job
+
+    _get_executor().submit(_run, job, func, args, kwargs)
+    return job
+
+
+# 登记在任务之外得到的结果（例如计算任务中顺带读取的文件），之后可按编号复用；
+# 同编号的任务已存在时不覆盖
+def store(key, result):
+    now = time.time()
+    job = {
+        "id": key,
+        "status": "done",
+        "progress": {},
+        "result": result,
+        "error": None,
+        "submitted_at": now,
+        "finished_at": now,
+        "used_at": now,
+        "size": result_size(result),
+    }
+    with _lock:
+        job = _jobs.setdefault(key, job)
+        _expire()
+    return job
+
+
+def _run(job, func, args, kwargs):
+    job["status"] = "running"
+    try:
+        with track_progress(job["progress"]):
+            job["result"] = func(*args, **kwargs)
+        job["size"] = result_size(job["result"])
+        job["status"] = "done"
+    except Exception as e:
+        job["error"] = str(e)
+        job["status"] = "failed"
+    finally:
+        with _lock:
+            job["finished_at"] = job["used_at"] = time.time()
+            _expire()
+
+
+# 按编号取任务，不存在（从未提交或已被淘汰）时返回 None
+def get_job(key):
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None:
+            job["used_at"] = time.time()
+        return job
+
+
+# 删除已结束的任务，以便重新提交（例如失败后重试）
+def discard(key):
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None and finished(job):
+            del _jobs[key]
+
+
+# 任务是否已结束（成功或失败）
+def finished(job):
+    return job["status"] in ("done", "failed")
@@ -0,0 +1,50 @@
+import time
+import streamlit as st
+import pandas as pd
+
+from history_store import HISTORY_DB, query_totals, query_transactions, stored_date_range
+
+
+# 汇总方式的说明
+BY_LABELS = {"person": "按人员", "department": "按部门", "day": "按日期"}
+
+
+# ---------------- Streamlit 页面 ----------------
+st.title("历史查询")
+
+first_day, last_day = stored_date_range()
+if first_day is None:
+    st.info("历史记录库为空：在计算页面点击“写入历史记录库”，或批量处理时指定 --history-db。")
+    st.stop()
+
+st.caption(f"数据库：{HISTORY_DB} ｜ 已有数据：{first_day} 至 {last_day}")
+
+col_start, col_end = st.columns(2)
+start = col_start.date_input("开始日期", value=pd.Timestamp(first_day).date())
+end = col_end.date_input("结束日期", value=pd.Timestamp(last_day).date())
+
+by = st.radio("汇总方式", list(BY_LABELS), format_func=BY_LABELS.get, horizontal=True)
+
+col_person, col_department = st.columns(2)
+person = col_person.text_input("个人编号（留空表示全部）").strip()
+department = col_department.text_input("卡户部门（留空表示全部）").strip()
+
+if start > end:
+    st.error("开始日期晚于结束日期。")
+    st.stop()
+
+started = time.perf_counter()
+summary = query_totals(by, start.isoformat(), end.isoformat(), person, department)
+elapsed = time.perf_counter() - started
+
+st.caption(f"共 {len(summary):,} 行，查询用时 {elapsed * 1000:.1f} 毫秒")
+st.dataframe(summary, use_container_width=True, hide_index=True)
+
+# 指定了个人编号时可查看该人的明细
+if person:
+    with st.expander("明细（最多 10,000 行）"):
+        st.dataframe(
+            query_transactions(start.isoformat(), end.isoformat(), person, department),
+            use_container_width=True,
+            hide_index=True
+        )
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pandas as pd
+
+from instrument import stage
+
+
+# 各计算方式下值得多进程计算的最少行数，少于此数或未列出的计算方式直接在当前进程计算
+# 多进程的固定开销（启动进程、导入模块）约 0.6 秒，分片和结果经共享内存往返约 0.26 微秒/行；
+# 向量化计算只需约 0.11 微秒/行，核数再多也抵不过往返开销，因此只对逐行计算（约 600 微秒/行）启用
+PARALLEL_MIN_ROWS = {"legacy": 20_000}
+
+
+# 可用的 CPU 核数
+def cpu_count():
+    return os.cpu_count() or 1
+
+
+# 把 DataFrame 以 Arrow IPC 格式写入一块新的共享内存，返回该共享内存
+# 先用 MockOutputStream 计算大小，再直接写入共享内存，不经过中间缓冲区
+def frame_to_shared(df):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    mock = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock, table.schema) as writer:
+        writer.write_table(table)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(mock.size(), 1))
+    try:
+        buffer = pa.py_buffer(shm.buf)
+        sink = pa.FixedSizeBufferWriter(buffer)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        # 释放对共享内存的引用，之后才能关闭
+        sink.close()
+        del sink, buffer
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    return shm
+
+
+# 从共享内存读取 DataFrame；unlink 为 True 时读完即释放该共享内存
+# 先整块复制到进程内存：pandas 的字符串列会直接引用 Arrow 缓冲区，不能指向随后关闭的共享内存
+def frame_from_shared(name, unlink=False):
+    import pyarrow as pa
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = pa.py_buffer(bytes(shm.buf))
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+    with pa.ipc.open_stream(data) as reader:
+        return reader.read_all().to_pandas()
+
+
+# 工作进程：从共享内存读入一个分片，计算餐补，结果写入新的共享内存并返回其名称
+def _compute_shard(name, calendar_index, engine, rules):
+    from subsidy import compute_subsidy
+
+    df = frame_from_shared(name)
+    result = compute_subsidy(df, calendar_index, engine, rules)
+    shm = frame_to_shared(result)
+    shm.close()
+    return shm.name
+
+
+# 按个人编号哈希把一个分区拆成若干分片，同一人的记录只在一个分片中，且保持原有顺序
+def shard_by_person(df, shard_count):
+    if shard_count <= 1:
+        return [df]
+    key = df["个人编号"].astype(str).str.strip()
+    bucket = pd.util.hash_pandas_object(key, index=False).to_numpy() % shard_count
+    return [df[bucket == i] for i in range(shard_count) if (bucket == i).any()]
+
+
+# 释放共享内存，已不存在时忽略
+def unlink_shared(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+# 多进程逐个分片计算餐补，按分区、分片顺序返回各分片的结果
+# 每人的记录只在一个分片中，合并后的结果与逐个分区计算完全一致
+@stage("subsidy_parallel")
+def compute_shards(partitions, calendar_index, engine, rules, workers):
+    shards = [shard for df in partitions for shard in shard_by_person(df, workers)]
+
+    inputs = []
+    outputs = []
+    try:
+        for shard in shards:
+            inputs.append(frame_to_shared(shard))
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(_compute_shard, shm.name, calendar_index, engine, rules)
+                for shm in inputs
+            ]
+
+        # 离开 with 语句时所有分片都已结束；先记下成功分片的结果，再抛出第一个错误
+        outputs = [future.result() for future in futures if future.exception() is None]
+        for future in futures:
+            future.result()
+
+        results = []
+        while outputs:
+            results.append(frame_from_shared(outputs.pop(0), unlink=True))
+        return results
+    finally:
+        for shm in inputs:
+            shm.close()
+            shm.unlink()
+        for name in outputs:
+            unlink_shared(name)
@@ -0,0 +1,107 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from holiday_calendar import CACHE_DIR, calendar_version
+from instrument import stage
+from subsidy import MEAL_WINDOWS
+
+
+# 整份计算结果的磁盘缓存目录，可通过环境变量 FOOD_RESULT_CACHE_DIR 指定；
+# 多个会话、多个用户及服务重启后共用
+RESULT_CACHE_DIR = os.environ.get("FOOD_RESULT_CACHE_DIR", os.path.join(CACHE_DIR, "result_cache"))
+
+# 缓存总大小上限（MB），超出后删除最久未用的文件
+RESULT_CACHE_MB = int(os.environ.get("FOOD_RESULT_CACHE_MB", "1024"))
+
+# 结果格式或计算逻辑变化时递增，使已缓存的结果全部失效
+CACHE_VERSION = 2
+
+
+# 结果的缓存键：文件内容摘要 + 加班调休 / 高温假日期 + 规则表摘要，
+# 另含餐补时间段、chinese_calendar 版本和计算方式，任何一项变化都视为不同的结果
+# 节假日日历只覆盖数据中出现的年份，由文件内容决定，不单独作为缓存键
+def result_cache_key(file_digest, overtime_key, high_temp_key, rules_key, engine="vectorized"):
+    text = json.dumps([
+        CACHE_VERSION, MEAL_WINDOWS, calendar_version(), engine, file_digest,
+        [str(d) for d in overtime_key], [str(d) for d in high_temp_key], rules_key,
+    ])
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# 读取缓存的结果，不存在或已损坏时返回 None；读取后更新修改时间作为最近使用时间
+@stage("cache_read")
+def load_result(key, cache_dir=RESULT_CACHE_DIR):
+    path = os.path.join(cache_dir, f"{key}.parquet")
+    try:
+        df_final = pd.read_parquet(path)
+        os.utime(path)
+    except (OSError, ValueError, ImportError):
+        return None
+    return df_final
+
+
+# 保存结果，并按总大小上限淘汰最久未用的文件；写入失败时不影响本次处理
+@stage("cache_write")
+def save_result(key, df_final, cache_dir=RESULT_CACHE_DIR, max_mb=RESULT_CACHE_MB):
+    path = os.path.join(cache_dir, f"{key}.parquet")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df_final.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except (OSError, ValueError, ImportError):
+        return
+    evict(cache_dir, max_mb * 1024 * 1024, keep=path)
+
+
+# 上传文件的基本信息（编码、年份、无法解析时间的条数），命中结果缓存时不必重新读取文件
+def load_file_info(file_digest, cache_dir=RESULT_CACHE_DIR):
+    path = os.path.join(cache_dir, f"{file_digest}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            info = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    info["years"] = set(info["years"])
+    return info
+
+
+def save_file_info(file_digest, info, cache_dir=RESULT_CACHE_DIR):
+    path = os.path.join(cache_dir, f"{file_digest}.json")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({**info, "years": sorted(info["years"])}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+# 按最近使用时间从旧到新删除缓存文件，直到总大小不超过上限；keep 指定的文件不删除
+def evict(cache_dir, max_bytes, keep=None):
+    paths = glob.glob(os.path.join(cache_dir, "*.parquet")) + glob.glob(os.path.join(cache_dir, "*.json"))
+    entries = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,139 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from holiday_calendar import CACHE_DIR
+from ingest import concat_frames
+from instrument import stage
+from subsidy import MEAL_WINDOWS, check_engine, compute_each, merge_results
+from subsidy_rules import load_rules, rules_digest
+
+
+# 按天保存的计算结果目录，可通过环境变量 FOOD_STORE_DIR 指定
+STORE_DIR = os.environ.get("FOOD_STORE_DIR", os.path.join(CACHE_DIR, "results"))
+
+# 结果格式或计算规则变化时递增，使已保存的结果全部失效
+STORE_VERSION = 3
+
+# 每天最多保留的结果版本数；多个文件共用一个目录时（如批量处理不同单位的导出），
+# 同一天的不同内容各自保留，按最近使用时间淘汰
+VERSIONS_PER_DAY = 8
+
+# 影响当天计算结果的输入列
+HASH_COLUMNS = [
+    "人员类别", "姓名", "个人编号", "卡片类型",
+    "交易地点", "卡户部门", "交易时间", "交易金额"
+]
+
+
+# 每天的输入指纹：当天所有行哈希之和（按 2^64 取模）与行数，
+# 与分区方式、行顺序无关，文件变长导致分区数变化时指纹不变
+def day_fingerprints(partitions):
+    fingerprints = {}
+    for df in partitions:
+        row_hash = pd.util.hash_pandas_object(df[HASH_COLUMNS], index=False).to_numpy()
+        codes, days = pd.factorize(df["交易日期"])
+
+        day_sums = np.zeros(len(days), dtype="uint64")
+        np.add.at(day_sums, codes, row_hash)
+        day_counts = np.bincount(codes, minlength=len(days))
+
+        for day, row_sum, count in zip(days, day_sums, day_counts):
+            prev_sum, prev_count = fingerprints.get(day, (0, 0))
+            fingerprints[day] = ((prev_sum + int(row_sum)) % 2 ** 64, prev_count + int(count))
+
+    return fingerprints
+
+
+# 每天的结果键：输入指纹 + 当天的工作日 / 放假标记 + 计算方式及规则
+# 只改动某几天的加班调休或高温假时，只有这几天的键会变化
+def day_keys(partitions, calendar_index, engine, rules):
+    rules_key = rules_digest(rules)
+    keys = {}
+    for day, (row_sum, count) in day_fingerprints(partitions).items():
+        day_class = calendar_index.loc[pd.Timestamp(day)]
+        text = json.dumps([
+            STORE_VERSION, engine, MEAL_WINDOWS, rules_key, row_sum, count,
+            bool(day_class["工作日"]), bool(day_class["放假"]),
+        ])
+        keys[day] = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    return keys
+
+
+# 某天某个键对应的结果文件，按“交易日期=YYYY-MM-DD”分目录存放
+def day_path(store_dir, day, key):
+    return os.path.join(store_dir, f"交易日期={day:%Y-%m-%d}", f"{key}.parquet")
+
+
+# 读取一天已保存的结果，并更新其修改时间作为最近使用时间
+@stage("store_read")
+def load_day(store_dir, day, key):
+    path = day_path(store_dir, day, key)
+    df_day = pd.read_parquet(path)
+    os.utime(path)
+    return df_day
+
+
+# 保存一天的结果，超出 VERSIONS_PER_DAY 时删除这一天最久未用的版本
+@stage("store_write")
+def save_day(store_dir, day, key, df_day):
+    path = day_path(store_dir, day, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df_day.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    versions = glob.glob(os.path.join(os.path.dirname(path), "*.parquet"))
+    if len(versions) <= VERSIONS_PER_DAY:
+        return
+
+    versions.sort(key=lambda p: os.stat(p).st_mtime if os.path.exists(p) else 0)
+    for old_path in versions[:-VERSIONS_PER_DAY]:
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+# 增量计算：输入和日历标记都没变的日期直接读取已保存的结果，其余日期重新计算并保存，
+# 返回 (合并后的结果, {"reused_days": 复用天数, "computed_days": 重新计算天数})
+def process_incremental(partitions, calendar_index, store_dir=STORE_DIR, engine="vectorized",
+                        rules=None, workers=1):
+    check_engine(engine)
+    if rules is None:
+        rules = load_rules()
+
+    keys = day_keys(partitions, calendar_index, engine, rules)
+    results = []
+    todo = []
+
+    # 先读取可复用的日期，读取失败（例如刚被其他进程替换）的日期改为重新计算
+    for day, key in keys.items():
+        try:
+            results.append(load_day(store_dir, day, key))
+        except (OSError, ValueError):
+            todo.append(day)
+
+    if todo:
+        changed = [df[df["交易日期"].isin(todo)] for df in partitions]
+        computed = compute_each(
+            [df for df in changed if not df.empty], calendar_index, engine, rules, workers
+        )
+        # 各分区的结果分别交给 merge_results（每一部分须各自排好序），合并后的只用于按天保存
+        results.extend(computed)
+        computed = concat_frames(computed)
+
+        for day, df_day in computed.groupby(computed["交易时间"].dt.normalize(), sort=False):
+            save_day(store_dir, day, keys[day], df_day)
+
+    if not results:
+        raise ValueError("清洗后没有可用数据，请检查“交易时间”列格式。")
+
+    df_final = merge_results(results).reset_index(drop=True)
+    return df_final, {"reused_days": len(keys) - len(todo), "computed_days": len(todo)}
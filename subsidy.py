@@ -0,0 +1,666 @@
+import warnings
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from holiday_calendar import (
+    build_calendar_index, holiday_data_available, holiday_date_set, lookup_calendar,
+    overtime_date_set,
+)
+from ingest import CHUNK_SIZE, REQUIRED_COLUMNS, concat_frames, open_partitions
+from instrument import report_progress, stage
+from parallel import PARALLEL_MIN_ROWS, compute_shards
+from subsidy_rules import SUBSIDY_CATEGORIES, load_rules, lookup_rules, match_rule
+
+
+# 餐补时间段：(名称, 开始时间, 结束时间)，两端都包含，按时间先后排列且互不重叠
+MEAL_WINDOWS = [
+    ("早餐", "07:20:00", "09:00:00"),
+    ("午餐", "11:00:00", "14:00:00"),
+    ("晚餐", "17:00:00", "20:00:00"),
+]
+OTHER_MEAL_PERIOD = "其他"
+
+# 计算结果列
+RESULT_COLUMNS = ["餐补金额", "自付（元）", "早餐（元）", "工作餐（元）", "加班餐（元）"]
+
+
+# 定义餐补时间段
+def get_meal_period(t, windows=MEAL_WINDOWS):
+    if t is None or pd.isna(t):
+        return OTHER_MEAL_PERIOD
+
+    for name, start, end in windows:
+        if datetime.strptime(start, "%H:%M:%S").time() <= t <= datetime.strptime(end, "%H:%M:%S").time():
+            return name
+    return OTHER_MEAL_PERIOD
+
+
+# 把时间段表转为分箱边界（当日零点起的纳秒数）：
+# [开始0, 结束0 + 1, 开始1, 结束1 + 1, ...]，落在奇数号区间内即属于对应时间段
+def meal_period_edges(windows=MEAL_WINDOWS):
+    edges = []
+    for _, start, end in windows:
+        edges.extend([pd.Timedelta(start).value, pd.Timedelta(end).value + 1])
+
+    edges = np.array(edges, dtype="int64")
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError("餐补时间段必须按时间先后排列且互不重叠。")
+    return edges
+
+
+# 按交易时间批量划分餐费时间段，返回分类列
+def classify_meal_period(trade_time, windows=MEAL_WINDOWS):
+    categories = [name for name, _, _ in windows] + [OTHER_MEAL_PERIOD]
+
+    time_of_day = (trade_time - trade_time.dt.normalize()).to_numpy(dtype="timedelta64[ns]")
+    positions = np.searchsorted(meal_period_edges(windows), time_of_day.astype("int64"), side="right")
+
+    in_window = positions % 2 == 1
+    codes = np.where(in_window, positions // 2, len(windows))
+    codes[np.isnat(time_of_day)] = len(windows)
+
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories),
+        index=trade_time.index,
+        name="餐费时间段",
+    )
+
+
+# 解析日期输入
+def parse_date_set(text):
+    dates = set()
+    invalid = []
+
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            dates.add(datetime.strptime(part, "%Y-%m-%d").date())
+        except ValueError:
+            invalid.append(part)
+
+    return dates, invalid
+
+
+# 根据人员类别、时段、是否工作日/节假日，按补贴规则表确定补贴上限
+def get_max_subsidy(person_type, meal_period, workday, is_holiday, rules=None, day=None):
+    if rules is None:
+        rules = load_rules()
+    return match_rule(rules, person_type, meal_period, workday, is_holiday, day)[0]
+
+
+# 计算单个分组的餐补
+def calculate_subsidy_group(group, overtime_dates, holiday_and_high_temp_days, rules=None):
+    if rules is None:
+        rules = load_rules()
+    group = group.copy()
+    subsidy_used = 0.0
+
+    # 因为已经按“餐费时间段”分组，所以组内取第一条即可
+    meal_period = group["餐费时间段"].iloc[0]
+
+    for idx, row in group.iterrows():
+        amount = float(row["交易金额"])
+
+        # 超市不参与餐补
+        if row["交易地点"] == "超市":
+            group.at[idx, "餐补金额"] = 0.0
+            group.at[idx, "自付（元）"] = round(amount, 2)
+            group.at[idx, "早餐（元）"] = 0.0
+            group.at[idx, "工作餐（元）"] = 0.0
+            group.at[idx, "加班餐（元）"] = 0.0
+            continue
+
+        trade_time = row["交易时间"]
+        date = trade_time.date()
+        weekday = trade_time.weekday()
+
+        workday = (weekday < 5) or (date in overtime_dates)
+        is_holiday = (date in holiday_and_high_temp_days) and (date not in overtime_dates)
+
+        max_subsidy, category = match_rule(
+            rules,
+            person_type=row["人员类别"],
+            meal_period=meal_period,
+            workday=workday,
+            is_holiday=is_holiday,
+            day=date,
+        )
+
+        available_subsidy = max(0.0, max_subsidy - subsidy_used)
+        subsidy_given = min(amount, available_subsidy)
+        subsidy_used += subsidy_given
+
+        group.at[idx, "餐补金额"] = round(subsidy_given, 2)
+        group.at[idx, "自付（元）"] = round(amount - subsidy_given, 2)
+
+        # 先清零，再按类别写入
+        group.at[idx, "早餐（元）"] = 0.0
+        group.at[idx, "工作餐（元）"] = 0.0
+        group.at[idx, "加班餐（元）"] = 0.0
+
+        if category:
+            group.at[idx, f"{category}（元）"] = round(subsidy_given, 2)
+
+    return group
+
+
+# 与内置 round(x, 2) 逐位一致的向量化两位小数舍入
+def round2(values):
+    values = np.asarray(values, dtype="float64")
+    rounded = np.round(values, 2)
+
+    # np.round 先乘 100 再取整，只在接近 .5 的临界值上可能与 round 不同，这些值逐个按内置 round 处理
+    scaled = np.abs(values) * 100
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_half):
+        rounded[i] = round(float(values[i]), 2)
+
+    return rounded
+
+
+# (人, 日, 餐段) 分组编号及每行在组内的序号，不做哈希分组
+# prepare_dataframe 排序后同一人同一天的记录相邻，“分组键”变化处即为一段的开始；
+# 段内按餐费时间段再分，组内序号为本段内同一餐段的累计条数
+def meal_groups(day_key, meal_period):
+    is_start = np.empty(len(day_key), dtype=bool)
+    is_start[:1] = True
+    np.not_equal(day_key[1:], day_key[:-1], out=is_start[1:])
+    run_ids = np.cumsum(is_start) - 1
+    starts = np.flatnonzero(is_start)
+
+    meal_codes, meal_periods = pd.factorize(meal_period, use_na_sentinel=False)
+    group_ids = run_ids * len(meal_periods) + meal_codes
+
+    position = np.empty(len(day_key), dtype="int64")
+    for m in range(len(meal_periods)):
+        in_meal = meal_codes == m
+        count = np.cumsum(in_meal)
+        # 每段开始之前该餐段的累计条数
+        before = count[starts] - in_meal[starts]
+        position[in_meal] = (count - 1 - before[run_ids])[in_meal]
+
+    return group_ids, position
+
+
+# 向量化计算餐补，结果与逐组调用 calculate_subsidy_group 逐位一致
+def calculate_subsidy_vectorized(df, calendar_index, rules=None):
+    if rules is None:
+        rules = load_rules()
+
+    # 与 groupby 一致：姓名或个人编号为空的记录不参与计算，也不进入结果
+    day_key = df["分组键"].to_numpy()
+    valid = day_key >= 0
+    if not valid.any():
+        return df.assign(**dict.fromkeys(RESULT_COLUMNS, 0.0))
+    if not valid.all():
+        df = df[valid]
+        day_key = day_key[valid]
+    group_ids, position = meal_groups(day_key, df["餐费时间段"])
+
+    amount = df["交易金额"].to_numpy(dtype="float64")
+    is_market = (df["交易地点"] == "超市").to_numpy(dtype=bool)
+
+    # 工作日 / 节假日标记，按交易日期查日历表
+    day_class = lookup_calendar(calendar_index, df["交易时间"])
+    workday = day_class["工作日"].to_numpy(dtype=bool)
+    is_holiday = day_class["放假"].to_numpy(dtype=bool)
+
+    # 每行补贴上限及类别，按规则表一次查出
+    max_subsidy, category = lookup_rules(
+        rules, df["人员类别"], df["餐费时间段"], workday, is_holiday, df["交易时间"]
+    )
+
+    # 组内已用额度逐层推进：第 k 轮同时处理所有分组的第 k 条记录，
+    # 累加顺序与逐行循环完全相同（pandas 的分组 cumsum 带误差补偿，会产生末位差异）
+    order = np.argsort(position, kind="stable")
+    bounds = np.searchsorted(position[order], np.arange(position.max() + 2))
+
+    subsidy_used = np.zeros(group_ids.max() + 1)
+    subsidy_given = np.zeros(len(df))
+
+    for k in range(len(bounds) - 1):
+        rows = order[bounds[k]:bounds[k + 1]]
+        groups = group_ids[rows]
+
+        available = np.maximum(0.0, max_subsidy[rows] - subsidy_used[groups])
+        given = np.minimum(amount[rows], available)
+        # 超市不参与餐补
+        given[is_market[rows]] = 0.0
+
+        subsidy_given[rows] = given
+        subsidy_used[groups] = subsidy_used[groups] + given
+
+    given_rounded = round2(subsidy_given)
+    result = {
+        "餐补金额": given_rounded,
+        "自付（元）": round2(amount - subsidy_given),
+    }
+
+    # 按类别写入
+    for i, name in enumerate(SUBSIDY_CATEGORIES):
+        result[f"{name}（元）"] = np.where(category == i, given_rounded, 0.0)
+
+    # assign 返回新的 DataFrame，不修改传入的 df
+    return df.assign(**result)
+
+
+# 去掉分类列各类别中的空格 / 制表符，去空格后相同的类别合并
+def strip_categories(series):
+    categories = series.cat.categories
+    if len(categories) == 0:
+        return series
+
+    stripped = pd.Index([c.strip() if isinstance(c, str) else c for c in categories])
+    new_categories = stripped.unique()
+    mapping = new_categories.get_indexer(stripped)
+    codes = series.cat.codes.to_numpy()
+    new_codes = np.where(codes >= 0, mapping[codes], -1)
+
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, new_categories),
+        index=series.index,
+        name=series.name,
+    )
+
+
+# 去掉字符串列里的空格 / 制表符：Arrow 字符串列直接用向量化的 str.strip；
+# 其他列先去重，只对不同的值逐个处理，再按编号还原到各行，非字符串值和空值保持不变
+def strip_strings(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow":
+        return series.str.strip()
+
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0:
+        return series
+
+    stripped = np.array([x.strip() if isinstance(x, str) else x for x in uniques], dtype=object)
+    values = np.where(codes >= 0, stripped[codes], series.to_numpy(dtype=object))
+    # object 列与逐个 map 时一样重新推断类型，字符串列保持原类型
+    return pd.Series(
+        values, index=series.index, name=series.name,
+        dtype=None if pd.api.types.is_object_dtype(dtype) else dtype,
+    )
+
+
+# 清洗原始数据的字符串与金额：选列、去空格、删除冲正、金额转正
+@stage("clean")
+def clean_columns(raw_df):
+    missing = [col for col in REQUIRED_COLUMNS if col not in raw_df.columns]
+    if missing:
+        raise ValueError(f"缺少必要列：{', '.join(missing)}")
+
+    # pandas 的写时复制下选列、筛选都不会立即复制数据，不再显式 copy
+    df = raw_df[REQUIRED_COLUMNS]
+
+    # 清理字符串列里的空格 / 制表符，分类列只处理类别
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            df[col] = strip_categories(df[col])
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            df[col] = strip_strings(df[col])
+
+    # 删除收费冲正
+    df = df[df["交易类型"] != "收费冲正"]
+
+    # 金额转为正数
+    df["交易金额"] = pd.to_numeric(df["交易金额"], errors="coerce").fillna(0).abs()
+
+    return df
+
+
+# 卡务系统导出中常见的交易时间格式，识别时得分相同的按此顺序优先
+TIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y/%m/%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y%m%d%H%M%S",
+]
+TIME_SAMPLE_SIZE = 1000
+
+
+# 从均匀抽取的样本中识别时间格式，按匹配条数从多到少返回能匹配的格式
+def detect_time_formats(values, sample_size=TIME_SAMPLE_SIZE):
+    values = values.dropna()
+    if values.empty:
+        return []
+
+    positions = np.unique(np.linspace(0, len(values) - 1, min(sample_size, len(values))).astype("int64"))
+    sample = values.iloc[positions]
+
+    scores = []
+    for fmt in TIME_FORMATS:
+        matched = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+        if matched:
+            scores.append((matched, fmt))
+
+    return [fmt for _, fmt in sorted(scores, key=lambda x: -x[0])]
+
+
+# 按识别出的格式逐个解析：每种格式只处理前面格式没能解析的行，
+# 剩余的行再交给 pandas 自动推断，仍无法解析的为 NaT
+# 全程按行位置处理，不依赖索引标签（索引可能有重复，例如 Parquet 中保存的索引）
+def parse_datetime_column(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return pd.to_datetime(values, errors="coerce")
+
+    # 尚未解析的行，以及 (行位置, 解析结果) 列表
+    pending = values.notna().to_numpy(copy=True)
+    parts = []
+
+    def parse_pending(fmt=None):
+        positions = np.flatnonzero(pending)
+        parsed = pd.to_datetime(values.iloc[positions], format=fmt, errors="coerce").to_numpy()
+        ok = ~np.isnat(parsed)
+        parts.append((positions[ok], parsed[ok]))
+        pending[positions[ok]] = False
+
+    for fmt in detect_time_formats(values[pending]):
+        parse_pending(fmt)
+        if not pending.any():
+            break
+
+    if pending.any():
+        # 剩下的多为无效值，pandas 推断不出格式时会逐个解析并给出警告，这里不再提示
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            parse_pending()
+    if not parts:
+        return pd.to_datetime(values, errors="coerce")
+
+    result = np.full(len(values), np.datetime64("NaT"), dtype=np.result_type(*(p.dtype for _, p in parts)))
+    for positions, parsed in parts:
+        result[positions] = parsed
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+# 解析交易时间并删除无法解析的记录，返回 (df, 无法解析的条数)
+@stage("time_parse")
+def parse_trade_time(df):
+    df["交易时间"] = parse_datetime_column(df["交易时间"])
+    invalid_time_count = int(df["交易时间"].isna().sum())
+
+    # 删除无法解析时间的记录
+    df = df[df["交易时间"].notna()]
+
+    return df, invalid_time_count
+
+
+# 清洗原始数据：选列、去空格、删除冲正、金额转正、解析时间
+def clean_dataframe(raw_df):
+    return parse_trade_time(clean_columns(raw_df))
+
+
+# 生成餐费时间段列
+def assign_meal_period(df):
+    return df.assign(餐费时间段=classify_meal_period(df["交易时间"]))
+
+
+# 人员编码：姓名、个人编号各按排序后的取值编号（空值排在最后，与 sort_values 一致），
+# 合成一个 int64，大小顺序与先按姓名、再按个人编号排序相同；同时返回两列都不为空的标记
+def person_codes(df):
+    name_codes, names = pd.factorize(df["姓名"], sort=True)
+    id_codes, ids = pd.factorize(df["个人编号"], sort=True)
+    valid = (name_codes >= 0) & (id_codes >= 0)
+    name_codes = np.where(name_codes >= 0, name_codes, len(names)).astype("int64")
+    id_codes = np.where(id_codes >= 0, id_codes, len(ids)).astype("int64")
+    return name_codes * (len(ids) + 1) + id_codes, valid
+
+
+# 按 (人员编码, 交易时间) 稳定排序的行顺序
+# 两者能合成一个不溢出的 int64 时只排序一次（比 lexsort 逐列排序快约一倍），否则退回 lexsort
+def person_time_order(person, trade_time):
+    ticks = trade_time.to_numpy().view("int64")
+    if not len(ticks):
+        return np.arange(0)
+
+    ticks = ticks - ticks.min()
+    span = int(ticks.max()) + 1
+    if (int(person.max()) + 1) * span < 2 ** 63:
+        return np.argsort(person * span + ticks, kind="stable")
+    return np.lexsort((ticks, person))
+
+
+# 划分餐段并排序，与节假日等参数无关，可缓存复用
+# 交易日期取当天零点的时间戳，按 int64 存储，不再生成逐行的 date 对象
+# 按 (人员编码, 交易时间) 一次稳定排序，与按姓名、个人编号、交易日期、交易时间排序的结果相同；
+# “分组键”为 (人, 日) 合成的 int64，排序后同一人同一天的记录相邻，姓名或个人编号为空时为 -1
+@stage("meal_bucketing")
+def prepare_dataframe(df):
+    trade_time = df["交易时间"]
+    day = trade_time.dt.normalize()
+    person, valid = person_codes(df)
+
+    day_number = day.to_numpy().astype("datetime64[D]").astype("int64")
+    day_number = day_number - day_number.min() if len(day_number) else day_number
+    day_key = np.where(valid, person * (int(day_number.max(initial=0)) + 1) + day_number, -1)
+
+    order = person_time_order(person, trade_time)
+    df = df.assign(交易日期=day, 分组键=day_key)
+    df = assign_meal_period(df)
+    return df.take(order)
+
+
+# 数据中出现的所有年份
+def data_years(frames):
+    years = set()
+    for df in frames:
+        years.update(int(y) for y in df["交易时间"].dt.year.unique())
+    return years
+
+
+# 构建覆盖数据年份及指定节假日年份的日历
+def build_calendar_for(frames, holiday_year, overtime_dates, high_temp_days):
+    years = data_years(frames) | {holiday_year}
+    return build_calendar_index(years, overtime_dates, high_temp_days)
+
+
+# 对准备好的数据计算餐补，不修改传入的 df
+# rules 为补贴规则表，不指定时读取默认规则文件
+@stage("subsidy")
+def compute_subsidy(df, calendar_index, engine="vectorized", rules=None):
+    if rules is None:
+        rules = load_rules()
+
+    if engine == "vectorized":
+        df_result = calculate_subsidy_vectorized(df=df, calendar_index=calendar_index, rules=rules)
+    else:
+        df = df.assign(**dict.fromkeys(RESULT_COLUMNS, 0.0))
+        overtime_dates = overtime_date_set(calendar_index)
+        holiday_and_high_temp_days = holiday_date_set(calendar_index)
+
+        # 不再使用 groupby.apply，直接显式遍历分组，兼容性最好
+        group_cols = ["姓名", "个人编号", "交易日期", "餐费时间段"]
+        result_groups = []
+
+        for _, group in df.groupby(group_cols, sort=False, observed=True):
+            result_groups.append(
+                calculate_subsidy_group(
+                    group=group,
+                    overtime_dates=overtime_dates,
+                    holiday_and_high_temp_days=holiday_and_high_temp_days,
+                    rules=rules
+                )
+            )
+
+        if result_groups:
+            df_result = pd.concat(result_groups, axis=0)
+            df_result = df_result.sort_values(by=["姓名", "个人编号", "交易日期", "交易时间"])
+        else:
+            df_result = df
+
+    return df_result[
+        ["人员类别", "姓名", "个人编号", "卡片类型", "交易地点", "卡户部门",
+         "交易时间", "交易金额", "早餐（元）", "工作餐（元）", "加班餐（元）", "自付（元）"]
+    ]
+
+
+# 校验计算引擎名称
+def check_engine(engine):
+    if engine not in ("vectorized", "legacy"):
+        raise ValueError(f"未知的计算引擎：{engine}")
+
+
+# 核心处理逻辑
+# engine: "vectorized" 为列式计算；"legacy" 为逐组逐行计算，保留用于对比结果
+def process_dataframe(raw_df, holiday_year, overtime_dates, high_temp_days, engine="vectorized",
+                      rules=None):
+    check_engine(engine)
+
+    df, invalid_time_count = clean_dataframe(raw_df)
+    if df.empty:
+        raise ValueError("清洗后没有可用数据，请检查“交易时间”列格式。")
+
+    df = prepare_dataframe(df)
+    calendar_index = build_calendar_for([df], holiday_year, overtime_dates, high_temp_days)
+    df_final = compute_subsidy(df, calendar_index, engine, rules)
+    return df_final, invalid_time_count
+
+
+# 清洗并准备一个分区，返回 (准备好的数据，清洗后为空时为 None, 无法解析时间的条数)
+def prepare_partition(part):
+    df, invalid_time_count = clean_dataframe(part)
+    return (None if df.empty else prepare_dataframe(df)), invalid_time_count
+
+
+# 逐个清洗、准备原始分区，返回 (分区列表, 无法解析时间的条数)
+def prepare_partitions(parts):
+    partitions = []
+    invalid_time_count = 0
+    for part in parts:
+        df, invalid = prepare_partition(part)
+        invalid_time_count += invalid
+        if df is not None:
+            partitions.append(df)
+    return partitions, invalid_time_count
+
+
+# 分块读取 CSV 并逐个分区清洗、准备，返回 (分区列表, 无法解析时间的条数, 编码)
+def load_csv_partitions(uploaded_file, encoding=None, chunksize=CHUNK_SIZE):
+    return load_partitions(uploaded_file, "csv", encoding=encoding, chunksize=chunksize)
+
+
+# 按格式读取上传文件并清洗、准备，返回值同 load_csv_partitions；非 CSV 时第三项为格式名
+# Parquet / Feather / Excel 只读取所需列，体积远小于同样内容的 CSV，整体读入作为一个分区
+def load_partitions(uploaded_file, file_format="csv", encoding=None, chunksize=CHUNK_SIZE):
+    with open_partitions(uploaded_file, file_format, encoding, chunksize) as (label, parts, _):
+        partitions, invalid_time_count = prepare_partitions(parts)
+    return partitions, invalid_time_count, label
+
+
+# 逐个分区计算餐补，返回各部分的结果列表
+# workers > 1 且数据量足够大时，按个人编号分片后多进程计算（需要 pyarrow），结果与单进程一致；
+# 只有逐行计算值得多进程（见 parallel.PARALLEL_MIN_ROWS），向量化计算总在当前进程进行
+def compute_each(partitions, calendar_index, engine="vectorized", rules=None, workers=1):
+    if rules is None:
+        rules = load_rules()
+
+    total = sum(len(df) for df in partitions)
+    report_progress("subsidy", 0, total)
+    min_rows = PARALLEL_MIN_ROWS.get(engine)
+    if workers > 1 and min_rows is not None and total >= min_rows:
+        results = compute_shards(partitions, calendar_index, engine, rules, workers)
+        report_progress("subsidy", total, total)
+        return results
+
+    results = []
+    done = 0
+    for df in partitions:
+        results.append(compute_subsidy(df, calendar_index, engine, rules))
+        done += len(df)
+        report_progress("subsidy", done, total)
+    return results
+
+
+# 逐个分区计算餐补后合并
+def compute_partitions(partitions, calendar_index, engine="vectorized", rules=None, workers=1):
+    check_engine(engine)
+
+    results = compute_each(partitions, calendar_index, engine, rules, workers)
+    if not results:
+        raise ValueError("清洗后没有可用数据，请检查“交易时间”列格式。")
+
+    return merge_results(results)
+
+
+# 合并多份计算结果，顺序与按姓名、个人编号、交易时间整体稳定排序相同
+# 与 prepare_dataframe 一样按 (人员编码, 交易时间) 合成的 int64 稳定排序，不对全部行按字符串排序；
+# 增量处理时同一人的记录可能分在按天保存的结果和新计算的分区中、时间交错，因此按行排序。
+# 个人编号在准备数据之前已确定类型（见 ingest.restore_person_id），编码顺序与按原值排序相同。
+# 合并后逐列按新顺序取行并替换原列，同一时间只多出一列的副本，而不是整表再复制一份
+@stage("merge")
+def merge_results(results):
+    results = [df for df in results if len(df)] or results[:1]
+    if len(results) == 1:
+        return results[0]
+
+    df_final = concat_frames(results)
+    person, _ = person_codes(df_final)
+    order = person_time_order(person, df_final["交易时间"])
+    if (order[1:] > order[:-1]).all():
+        return df_final
+
+    index = df_final.index.take(order)
+    for col in df_final.columns:
+        df_final[col] = df_final[col].array.take(order)
+    return df_final.set_axis(index)
+
+
+# 逐个原始分区清洗、准备并计算后合并，返回 (结果, 无法解析时间的条数)
+# 每个分区算完只保留计算结果，不同时持有全部准备好的分区。
+# 日历先按读取时收集的年份（见 ingest.leading_years，只取有节假日数据的年份，免得无效值带来多余的警告）
+# 及 extra_years 构建；分区中出现日历之外的年份时补入后重建。各年份的日历互不影响，结果与先收集全部年份相同
+def compute_stream(parts, year_hints, overtime_dates, high_temp_days, engine="vectorized", rules=None,
+                   workers=1, extra_years=()):
+    check_engine(engine)
+    if rules is None:
+        rules = load_rules()
+
+    calendar_years = {y for y in year_hints if holiday_data_available(y)} | set(extra_years)
+    calendar_index = None
+    if calendar_years:
+        calendar_index = build_calendar_index(calendar_years, overtime_dates, high_temp_days)
+
+    results = []
+    invalid_time_count = 0
+    done = 0
+    for part in parts:
+        df, invalid = prepare_partition(part)
+        invalid_time_count += invalid
+        if df is None:
+            continue
+
+        years = data_years([df])
+        if not years <= calendar_years:
+            calendar_years |= years
+            calendar_index = build_calendar_index(calendar_years, overtime_dates, high_temp_days)
+
+        results.extend(compute_each([df], calendar_index, engine, rules, workers))
+        done += len(df)
+        report_progress("subsidy", done)
+
+    if not results:
+        raise ValueError("清洗后没有可用数据，请检查“交易时间”列格式。")
+    return merge_results(results), invalid_time_count
+
+
+# 分块流式处理 CSV：按个人编号分区，逐个分区清洗、计算后合并
+def process_csv_in_chunks(uploaded_file, holiday_year, overtime_dates, high_temp_days,
+                          engine="vectorized", encoding=None, chunksize=CHUNK_SIZE, rules=None,
+                          workers=1):
+    with open_partitions(uploaded_file, "csv", encoding, chunksize) as (used_encoding, parts, years):
+        df_final, invalid_time_count = compute_stream(
+            parts, years, overtime_dates, high_temp_days, engine, rules, workers, {holiday_year}
+        )
+
+    return df_final, invalid_time_count, used_encoding
@@ -0,0 +1,156 @@
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# 补贴规则表路径，可通过环境变量 FOOD_RULES_FILE 指定
+RULES_FILE = os.environ.get(
+    "FOOD_RULES_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "subsidy_rules.csv")
+)
+
+# 规则表的列：前四列为匹配条件（留空表示任意），按表中顺序取第一条匹配的规则；
+# 生效日期 / 失效日期都包含当天，留空表示不限
+RULE_COLUMNS = [
+    "人员类别", "餐费时间段", "工作日", "放假",
+    "上限（元）", "类别", "生效日期", "失效日期"
+]
+
+# 补贴类别，对应结果中的“xx（元）”列；类别留空表示不计入任何一列
+SUBSIDY_CATEGORIES = ["早餐", "工作餐", "加班餐"]
+
+FLAG_VALUES = {"是": True, "否": False, "": None}
+
+
+# 读取并校验规则表，文件不变时直接复用上次的结果
+def load_rules(path=None):
+    path = path or RULES_FILE
+    return _read_rules(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _read_rules(path, mtime_ns):
+    rules = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    return check_rules(rules)
+
+
+# 校验规则表并转换各列类型，出错时给出行号
+def check_rules(rules):
+    missing = [col for col in RULE_COLUMNS if col not in rules.columns]
+    if missing:
+        raise ValueError(f"补贴规则表缺少列：{', '.join(missing)}")
+
+    rules = rules[RULE_COLUMNS].astype(str).apply(lambda col: col.str.strip())
+    checked = []
+    for i, row in enumerate(rules.itertuples(index=False), start=2):
+        row = dict(zip(RULE_COLUMNS, row))
+        try:
+            if row["工作日"] not in FLAG_VALUES or row["放假"] not in FLAG_VALUES:
+                raise ValueError("“工作日”“放假”只能填 是 / 否 或留空")
+            if row["类别"] and row["类别"] not in SUBSIDY_CATEGORIES:
+                raise ValueError(f"“类别”只能填 {' / '.join(SUBSIDY_CATEGORIES)} 或留空")
+
+            cap = float(row["上限（元）"])
+            if not cap >= 0:
+                raise ValueError("“上限（元）”不能为负数")
+
+            start = pd.Timestamp(row["生效日期"]).date() if row["生效日期"] else None
+            end = pd.Timestamp(row["失效日期"]).date() if row["失效日期"] else None
+            if start and end and start > end:
+                raise ValueError("“生效日期”晚于“失效日期”")
+        except ValueError as e:
+            raise ValueError(f"补贴规则表第 {i} 行有误：{e}")
+
+        checked.append({
+            **row,
+            "工作日": FLAG_VALUES[row["工作日"]],
+            "放假": FLAG_VALUES[row["放假"]],
+            "上限（元）": cap,
+            "生效日期": start,
+            "失效日期": end,
+        })
+
+    return pd.DataFrame(checked, columns=RULE_COLUMNS)
+
+
+# 规则表内容的摘要，用作缓存键
+def rules_digest(rules):
+    text = rules.to_csv(index=False)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# 取第一条匹配的规则，返回 (补贴上限, 类别)；没有匹配的规则时不补贴
+def match_rule(rules, person_type, meal_period, workday, is_holiday, day=None):
+    for rule in rules.itertuples(index=False):
+        person_rule, meal_rule, workday_rule, holiday_rule, cap, category, start, end = rule
+        if person_rule and person_rule != person_type:
+            continue
+        if meal_rule and meal_rule != meal_period:
+            continue
+        if workday_rule is not None and workday_rule != bool(workday):
+            continue
+        if holiday_rule is not None and holiday_rule != bool(is_holiday):
+            continue
+        if day is not None and ((start and day < start) or (end and day > end)):
+            continue
+        return cap, category
+    return 0.0, ""
+
+
+# 按生效 / 失效日期把日期轴切成若干段，同一段内适用的规则相同
+# 返回各段分界（datetime64[D]，每段从分界当天开始）和每段的代表日期
+def rule_periods(rules):
+    edges = set()
+    for start, end in zip(rules["生效日期"], rules["失效日期"]):
+        if start:
+            edges.add(np.datetime64(start, "D"))
+        if end:
+            edges.add(np.datetime64(end, "D") + 1)
+
+    edges = np.array(sorted(edges), dtype="datetime64[D]")
+    if not len(edges):
+        return edges, [None]
+
+    days = [(edges[0] - 1).item()] + [edge.item() for edge in edges]
+    return edges, days
+
+
+# 把规则表编译成查找数组：[日期段, 人员类别, 餐费时间段, 工作日, 放假] -> 上限 / 类别编号
+# 只对数据中实际出现的人员类别和时段展开，数组很小
+def compile_rules(rules, person_types, meal_periods):
+    edges, days = rule_periods(rules)
+    shape = (len(days), len(person_types), len(meal_periods), 2, 2)
+    caps = np.zeros(shape)
+    categories = np.full(shape, -1, dtype="int8")
+
+    for d, day in enumerate(days):
+        for p, person_type in enumerate(person_types):
+            for m, meal_period in enumerate(meal_periods):
+                for workday in (0, 1):
+                    for is_holiday in (0, 1):
+                        cap, category = match_rule(rules, person_type, meal_period, workday, is_holiday, day)
+                        caps[d, p, m, workday, is_holiday] = cap
+                        if category:
+                            categories[d, p, m, workday, is_holiday] = SUBSIDY_CATEGORIES.index(category)
+
+    return edges, caps, categories
+
+
+# 批量查规则：一次编译、一次按下标取值，返回与输入对齐的 (上限数组, 类别编号数组)
+# 类别编号对应 SUBSIDY_CATEGORIES，-1 表示不计入任何类别
+def lookup_rules(rules, person_type, meal_period, workday, is_holiday, trade_time):
+    person_codes, person_types = pd.factorize(person_type, use_na_sentinel=False)
+    meal_codes, meal_periods = pd.factorize(meal_period, use_na_sentinel=False)
+    edges, caps, categories = compile_rules(rules, list(person_types), list(meal_periods))
+
+    if len(edges):
+        days = np.asarray(trade_time, dtype="datetime64[ns]").astype("datetime64[D]")
+        period = np.searchsorted(edges, days, side="right")
+    else:
+        period = np.zeros(len(person_codes), dtype="int64")
+
+    index = (period, person_codes, meal_codes, workday.astype("int8"), is_holiday.astype("int8"))
+    return caps[index], categories[index]
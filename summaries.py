@@ -0,0 +1,73 @@
+import pandas as pd
+
+
+# 汇总的金额列
+AMOUNT_COLUMNS = ["交易金额", "早餐（元）", "工作餐（元）", "加班餐（元）", "自付（元）"]
+SUBSIDY_COLUMNS = ["早餐（元）", "工作餐（元）", "加班餐（元）"]
+
+
+# 最细粒度的一次分组汇总：每人每部门每天的笔数和各金额列，其余汇总表都由它再次汇总得到，
+# 不必对明细重复分组
+def aggregate(df_final):
+    day = df_final["交易时间"].dt.normalize().rename("交易日期")
+    return df_final.groupby(
+        [df_final["个人编号"], df_final["姓名"], df_final["卡户部门"], day],
+        observed=True, sort=False, dropna=False,
+    ).agg(
+        笔数=("交易金额", "size"),
+        **{col: (col, "sum") for col in AMOUNT_COLUMNS},
+    )
+
+
+# 把汇总结果按指定列再次汇总，另加餐补合计；金额保留两位小数
+def rollup(base, keys):
+    summary = base.groupby(level=keys, observed=True, sort=True, dropna=False).sum()
+    summary["餐补合计（元）"] = summary[SUBSIDY_COLUMNS].sum(axis=1)
+    money = AMOUNT_COLUMNS + ["餐补合计（元）"]
+    summary[money] = summary[money].round(2)
+    return summary.reset_index()
+
+
+# 按人员、部门、日期的汇总表，只对明细分组一次
+def summary_tables(df_final):
+    base = aggregate(df_final)
+    by_day = rollup(base, ["交易日期"])
+    by_day["交易日期"] = by_day["交易日期"].dt.date
+    return {
+        "按人员汇总": rollup(base, ["个人编号", "姓名"]),
+        "按部门汇总": rollup(base, ["卡户部门"]),
+        "按日期汇总": by_day,
+    }
+
+
+# 各类别合计：每个补贴类别及自付一行
+def category_totals(df_final):
+    totals = df_final[SUBSIDY_COLUMNS + ["自付（元）"]].sum().round(2)
+    counts = (df_final[SUBSIDY_COLUMNS + ["自付（元）"]] > 0).sum()
+    return pd.DataFrame({
+        "类别": [col.replace("（元）", "") for col in totals.index],
+        "笔数": counts.to_numpy(),
+        "金额（元）": totals.to_numpy(),
+    })
+
+
+# 明细筛选：关键词匹配姓名或个人编号，部门为空时不限，返回满足条件的行位置
+def filter_positions(df_final, keyword="", departments=()):
+    mask = pd.Series(True, index=df_final.index)
+
+    keyword = (keyword or "").strip()
+    if keyword:
+        mask &= (
+            df_final["姓名"].astype(str).str.contains(keyword, regex=False, na=False)
+            | df_final["个人编号"].astype(str).str.contains(keyword, regex=False, na=False)
+        )
+    if departments:
+        mask &= df_final["卡户部门"].isin(departments)
+
+    return mask.to_numpy().nonzero()[0]
+
+
+# 取一页数据，页码从 1 开始
+def page_of(df, positions, page, page_size):
+    start = (page - 1) * page_size
+    return df.iloc[positions[start:start + page_size]]